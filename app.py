@@ -1,9 +1,15 @@
-import os, time, json, hashlib
+import os, time, json, hashlib, zlib, gzip, datetime, threading, mimetypes, random, atexit
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
 from functools import wraps
-from flask import Flask, request, jsonify, send_from_directory
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context, abort, has_request_context
+from werkzeug.security import safe_join
 
-import firebase_admin
-from firebase_admin import credentials, auth, firestore
+try:
+    import brotli  # optional: pip install brotli (enables br for dynamic responses)
+except ImportError:
+    brotli = None
 
 APP_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -16,8 +22,82 @@ SERVICE_ACCOUNT_PATH = os.environ.get(
 )
 
 FIREBASE_PROJECT_ID = os.environ.get("FIREBASE_PROJECT_ID")  # optional
+# Open the Firestore channel and fetch ID-token signing keys in a background thread at worker start
+FIREBASE_WARMUP = os.environ.get("FIREBASE_WARMUP", "1") == "1"
 PORT = int(os.environ.get("PORT", "5000"))
 
+# JSON responses at least this large are gzip/br compressed when the client accepts it
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+
+# Idempotency-Key replay window, and how many recent keys each process keeps in memory
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", "4096"))
+
+# Transactions: contention aborts are retried with jittered exponential backoff, and writers to
+# the same wallet inside one process queue on a per-document lock instead of aborting each other
+TXN_MAX_ATTEMPTS = int(os.environ.get("TXN_MAX_ATTEMPTS", "5"))
+TXN_BACKOFF_BASE_MS = int(os.environ.get("TXN_BACKOFF_BASE_MS", "25"))
+TXN_BACKOFF_MAX_MS = int(os.environ.get("TXN_BACKOFF_MAX_MS", "800"))
+WALLET_LOCKS = os.environ.get("WALLET_LOCKS", "1") == "1"
+
+# Background purge of a removed kid's history: docs deleted per batched commit, and how long a
+# "running" job may go without progress before a status check restarts it
+PURGE_BATCH_SIZE = int(os.environ.get("PURGE_BATCH_SIZE", "200"))
+PURGE_STALE_SECONDS = int(os.environ.get("PURGE_STALE_SECONDS", "120"))
+
+# Request tracing: a TRACE_SAMPLE_RATE fraction of requests is traced. TRACE_SLOW_MS > 0 (off by
+# default) also keeps any request slower than that, which means collecting spans on every request
+# to decide afterwards. Kept traces sit in a ring buffer of TRACE_BUFFER_SIZE and can be fetched as
+# Chrome-trace JSON from /api/admin/traces; with TRACE_DUMP_PATH set, each serving process also
+# writes its own at exit (traces.json -> traces.<pid>.json).
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_MS = int(os.environ.get("TRACE_SLOW_MS", "0"))
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", "200"))
+TRACE_MAX_SPANS = int(os.environ.get("TRACE_MAX_SPANS", "2000"))
+TRACE_DUMP_PATH = os.environ.get("TRACE_DUMP_PATH")
+
+# Catalog delta sync: removed items are remembered (as tombstones) for the last CATALOG_TOMBSTONE_MAX
+# removals; clients whose version predates the oldest one get the full catalog instead of a delta
+CATALOG_TOMBSTONE_MAX = int(os.environ.get("CATALOG_TOMBSTONE_MAX", "200"))
+
+# Independent Firestore reads within one request are fanned out on this pool
+IO_THREADS = int(os.environ.get("IO_THREADS", "16"))
+
+# Export endpoints read Firestore in chunks of this many docs (bounded memory per stream)
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", "500"))
+
+# Ledger archival: events older than the retention window are sealed into gzip NDJSON segments,
+# stored as objects in the LEDGER_ARCHIVE_BUCKET GCS bucket or as files under LEDGER_ARCHIVE_DIR.
+# The live docs are deleted once sealed, so the store must be durable and shared by all instances
+# (a bucket, or a mounted volume; not the container filesystem). Archiving is refused until one is set.
+LEDGER_ARCHIVE_BUCKET = os.environ.get("LEDGER_ARCHIVE_BUCKET")
+LEDGER_ARCHIVE_DIR = os.environ.get("LEDGER_ARCHIVE_DIR")
+LEDGER_RETENTION_DAYS = int(os.environ.get("LEDGER_RETENTION_DAYS", "365"))
+LEDGER_SEGMENT_MAX = int(os.environ.get("LEDGER_SEGMENT_MAX", "5000"))
+
+# Firestore allows 500 writes per batch; stay under it
+FIRESTORE_BATCH_SIZE = 400
+
+GENESIS_HASH = "0"*64
+
+# Sharded ledger: each member gets its own hash sub-chain (head doc per chain), so appends for
+# different kids don't serialize on one "latest entry" query. Family-level ANCHOR entries fold all
+# chain heads into the family chain at most once per LEDGER_ANCHOR_INTERVAL seconds.
+LEDGER_SHARDED = os.environ.get("LEDGER_SHARDED", "0") == "1"
+LEDGER_ANCHOR_INTERVAL = int(os.environ.get("LEDGER_ANCHOR_INTERVAL", "300"))
+FAMILY_CHAIN = "family"
+
+# Purchase history paging and daily spending rollups
+HISTORY_PAGE_SIZE = 50
+HISTORY_PAGE_MAX = 200
+ROLLUP_MAX_DAYS = 366
+# Rollup days are cut at local midnight for this UTC offset (e.g. -420 for US Pacific daylight time)
+ROLLUP_UTC_OFFSET_MINUTES = int(os.environ.get("ROLLUP_UTC_OFFSET_MINUTES", "0"))
+
+# Balance/minutes time series: one array-packed doc per kid per day, downsampled on read
+TIMESERIES_MAX_DAYS = 366
+TIMESERIES_DEFAULT_POINTS = 300
+
 # If using emulator locally (optional):
 # set FIRESTORE_EMULATOR_HOST=localhost:8080
 # set FIREBASE_AUTH_EMULATOR_HOST=localhost:9099   (NOTE: firebase-admin token verify doesn't use this)
@@ -33,10 +113,235 @@ app.config["JSON_SORT_KEYS"] = False
 @app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,X-Family-Id')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,X-Family-Id,Idempotency-Key')
     response.headers.add('Access-Control-Allow-Methods', 'GET,POST,PUT,DELETE,OPTIONS')
+    return compress_response(response)
+
+def accepted_encoding(offered) -> str:
+    """Pick the first encoding in `offered` the client accepts (q > 0), or None."""
+    for enc in offered:
+        if request.accept_encodings.quality(enc) > 0:
+            return enc
+    return None
+
+def compress_response(response):
+    """Compress dynamic JSON above COMPRESS_MIN_BYTES; files and streams are left alone."""
+    if (response.direct_passthrough or response.is_streamed
+            or response.mimetype != "application/json"
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    enc = accepted_encoding(("br", "gzip") if brotli else ("gzip",))
+    if enc == "br":
+        response.set_data(brotli.compress(data, quality=5))
+    elif enc == "gzip":
+        response.set_data(gzip.compress(data, compresslevel=6))
+    else:
+        return response
+    response.headers["Content-Encoding"] = enc
     return response
 
+def send_precompressed(directory: str, filename: str):
+    """
+    Serve filename, preferring a build-time .br/.gz sibling (see precompress_static.py)
+    when the client accepts it and the variant is not older than the original.
+    """
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    for enc, ext in (("br", ".br"), ("gzip", ".gz")):
+        variant = path + ext
+        if (accepted_encoding((enc,)) and os.path.isfile(variant)
+                and os.path.getmtime(variant) >= os.path.getmtime(path)):
+            with trace_span("send_file", file=filename + ext):
+                resp = send_from_directory(directory, filename + ext, mimetype=mimetype)
+            resp.headers["Content-Encoding"] = enc
+            break
+    else:
+        with trace_span("send_file", file=filename):
+            resp = send_from_directory(directory, filename, mimetype=mimetype)
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+# -------------------------
+# Request tracing (sampled, in-process, Chrome-trace output)
+# -------------------------
+_trace_local = threading.local()
+_traces = deque(maxlen=TRACE_BUFFER_SIZE)
+_traces_lock = threading.Lock()
+
+def current_trace():
+    return getattr(_trace_local, "trace", None)
+
+@contextmanager
+def trace_span(name: str, **args):
+    """Time a block as a span of the current request's trace (no-op when the request isn't traced)."""
+    tr = current_trace()
+    if tr is None:
+        yield
+        return
+    ts = time.time_ns() // 1000
+    t0 = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        if len(tr["events"]) < TRACE_MAX_SPANS:
+            tr["events"].append({
+                "name": name, "ph": "X", "ts": ts, "dur": (time.perf_counter_ns() - t0) // 1000,
+                "tid": threading.get_ident(), "args": args
+            })
+        else:
+            tr["dropped"] += 1
+
+def traced(name: str):
+    """Decorator form of trace_span."""
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if current_trace() is None:
+                return fn(*args, **kwargs)
+            with trace_span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def with_trace(tr, fn):
+    """Run fn on another thread as part of trace tr (used by the I/O pool)."""
+    _trace_local.trace = tr
+    try:
+        return fn()
+    finally:
+        _trace_local.trace = None
+
+@app.before_request
+def start_trace():
+    sampled = random.random() < TRACE_SAMPLE_RATE
+    if not sampled and TRACE_SLOW_MS <= 0:
+        _trace_local.trace = None
+        return
+    _trace_local.trace = {
+        "name": f"{request.method} {request.path}",
+        "sampled": sampled,
+        "ts": time.time_ns() // 1000,
+        "t0": time.perf_counter_ns(),
+        "tid": threading.get_ident(),
+        "events": [],
+        "dropped": 0
+    }
+
+@app.teardown_request
+def finish_trace(exc=None):
+    tr = current_trace()
+    _trace_local.trace = None
+    if tr is None:
+        return
+    dur_us = (time.perf_counter_ns() - tr["t0"]) // 1000
+    if not tr["sampled"] and dur_us < TRACE_SLOW_MS * 1000:
+        return
+    user = getattr(request, "user", None) or {}
+    tr.update(dur=dur_us, family_id=user.get("family_id"), error=repr(exc) if exc else None)
+    with _traces_lock:
+        _traces.append(tr)
+
+def chrome_trace(traces: list) -> dict:
+    """Chrome trace-event JSON (chrome://tracing, ui.perfetto.dev); one process row per request."""
+    events = []
+    for pid, tr in enumerate(traces, start=1):
+        label = f"{tr['name']} {tr['dur'] / 1000:.1f}ms" + (" (sampled)" if tr["sampled"] else "")
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": label}})
+        events.append({"name": tr["name"], "ph": "X", "ts": tr["ts"], "dur": tr["dur"], "pid": pid,
+                       "tid": tr["tid"], "args": {"dropped_spans": tr["dropped"], "error": tr.get("error")}})
+        for e in tr["events"]:
+            events.append(dict(e, pid=pid))
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+def trace_dump_path(path: str) -> str:
+    """Per-process dump file: gunicorn workers each hold their own buffer."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid()}{ext or '.json'}"
+
+def dump_traces(path: str, family_id: str = None) -> int:
+    """Write this process's kept traces to trace_dump_path(path); returns how many."""
+    with _traces_lock:
+        traces = [t for t in _traces if family_id is None or t.get("family_id") == family_id]
+    out = trace_dump_path(path)
+    tmp = out + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(chrome_trace(traces), f)
+    os.replace(tmp, out)
+    return len(traces)
+
+def dump_traces_at_exit():
+    if _traces:
+        dump_traces(TRACE_DUMP_PATH)
+
+def register_trace_dump():
+    """
+    Call from the serving process (gunicorn post_fork, or __main__). Registering at import would
+    also run in the preloading master, whose buffer is always empty.
+    """
+    if TRACE_DUMP_PATH:
+        atexit.register(dump_traces_at_exit)
+
+def instrument_firestore():
+    """
+    Wrap the Firestore client's read/query/commit entry points in trace spans.
+    Some of these are private to google-cloud-firestore; a target that's missing after an upgrade
+    is skipped with a warning, and span labels that fail to compute are left empty, so tracing
+    can only lose detail, never break Firestore access.
+    """
+    def span_args(arg_fn, obj) -> dict:
+        try:
+            return arg_fn(obj)
+        except Exception:
+            return {}
+
+    def wrap_call(cls, attr, name, arg_fn):
+        orig = getattr(cls, attr)
+        @wraps(orig)
+        def wrapper(self, *args, **kwargs):
+            if current_trace() is None:
+                return orig(self, *args, **kwargs)
+            with trace_span(name, **span_args(arg_fn, self)):
+                return orig(self, *args, **kwargs)
+        setattr(cls, attr, wrapper)
+
+    def wrap_gen(cls, attr, name, arg_fn):
+        # Generators are timed until exhausted, which is when their RPC stream finishes
+        orig = getattr(cls, attr)
+        @wraps(orig)
+        def wrapper(self, *args, **kwargs):
+            if current_trace() is None:
+                yield from orig(self, *args, **kwargs)
+                return
+            with trace_span(name, **span_args(arg_fn, self)):
+                yield from orig(self, *args, **kwargs)
+        setattr(cls, attr, wrapper)
+
+    try:
+        from google.cloud.firestore_v1 import document, query, client, batch, transaction
+        targets = [
+            (wrap_call, document.DocumentReference, "get", "firestore.get", lambda self: {"path": self.path}),
+            (wrap_gen, client.Client, "get_all", "firestore.get_all", lambda self: {}),
+            (wrap_gen, query.Query, "_make_stream", "firestore.query", lambda self: {"collection": self._parent.id}),
+            (wrap_call, batch.WriteBatch, "commit", "firestore.commit", lambda self: {"writes": len(self._write_pbs)}),
+            (wrap_call, transaction.Transaction, "_commit", "firestore.commit", lambda self: {"txn": True, "writes": len(self._write_pbs)}),
+        ]
+    except Exception as e:
+        app.logger.warning(f"[TRACE] Firestore spans disabled: {e!r}")
+        return
+    for wrap, cls, attr, name, arg_fn in targets:
+        try:
+            wrap(cls, attr, name, arg_fn)
+        except Exception as e:
+            app.logger.warning(f"[TRACE] No {name} spans ({cls.__name__}.{attr}): {e!r}")
+
 # -------------------------
 # Defaults (stored per family in Firestore)
 # -------------------------
@@ -102,6 +407,7 @@ def clamp_money(x) -> float:
 def sha256(s: str) -> str:
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
 
+@traced("compute_ledger_hash")
 def compute_ledger_hash(ts, actor_uid, target_uid, typ, payload_json, prev_hash):
     s = f"{ts}|{actor_uid}|{target_uid}|{typ}|{payload_json}|{prev_hash}"
     return sha256(s)
@@ -109,15 +415,69 @@ def compute_ledger_hash(ts, actor_uid, target_uid, typ, payload_json, prev_hash)
 # -------------------------
 # Firebase init
 # -------------------------
+# firebase_admin, the credential parse and the Firestore client are created on first use rather
+# than at import, so a cold instance can answer /api/health before paying for them.
+# `db`, `firestore` and `auth` below are stand-ins that initialize on first attribute access.
 if not os.path.exists(SERVICE_ACCOUNT_PATH):
     raise RuntimeError(
         f"Missing service account key at {SERVICE_ACCOUNT_PATH}. "
         f"Put serviceAccountKey.json next to app.py or set GOOGLE_APPLICATION_CREDENTIALS."
     )
 
-cred = credentials.Certificate(SERVICE_ACCOUNT_PATH)
-firebase_admin.initialize_app(cred, {"projectId": FIREBASE_PROJECT_ID} if FIREBASE_PROJECT_ID else None)
-db = firestore.client()
+_firebase = {}
+_firebase_lock = threading.Lock()
+
+def init_firebase() -> dict:
+    """Import firebase_admin and create the app + clients once (thread-safe)."""
+    if "db" in _firebase:
+        return _firebase
+    with _firebase_lock:
+        if "db" not in _firebase:
+            import firebase_admin
+            from firebase_admin import credentials, auth, firestore
+
+            cred = credentials.Certificate(SERVICE_ACCOUNT_PATH)
+            fb_app = firebase_admin.initialize_app(cred, {"projectId": FIREBASE_PROJECT_ID} if FIREBASE_PROJECT_ID else None)
+            instrument_firestore()
+            _firebase.update(app=fb_app, auth=auth, firestore=firestore, db=firestore.client())
+    return _firebase
+
+class _Deferred:
+    """Module-level handle that forwards attribute access to a lazily created Firebase object."""
+    def __init__(self, key: str):
+        self._key = key
+
+    def __getattr__(self, name):
+        return getattr(init_firebase()[self._key], name)
+
+db = _Deferred("db")
+firestore = _Deferred("firestore")
+auth = _Deferred("auth")
+
+def warm_up_firebase():
+    """Pay the first-request costs up front: client init, gRPC channel, token signing keys."""
+    t0 = time.time()
+    try:
+        fb = init_firebase()
+        fb["db"].collection("families").document("_warmup").get()
+    except Exception as e:
+        app.logger.warning(f"[WARMUP] Firestore warm-up failed: {e}")
+        return
+    try:
+        # Prime the certificate cache verify_id_token uses (private API; best effort)
+        from firebase_admin import _token_gen
+        verifier = fb["auth"]._get_client(fb["app"])._token_verifier
+        verifier.request(_token_gen.ID_TOKEN_CERT_URI, method="GET")
+    except Exception as e:
+        app.logger.info(f"[WARMUP] Token key prefetch skipped: {e}")
+    app.logger.info(f"[WARMUP] Firebase ready in {(time.time() - t0) * 1000:.0f} ms")
+
+def start_firebase_warmup():
+    """Call once per serving process (after fork); no-op when FIREBASE_WARMUP=0."""
+    if FIREBASE_WARMUP:
+        threading.Thread(target=warm_up_firebase, name="firebase-warmup", daemon=True).start()
+
+io_pool = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="fs-io")
 
 # -------------------------
 # Firestore helpers
@@ -140,6 +500,203 @@ def purchases_col(family_id: str):
 def ledger_col(family_id: str):
     return fam_ref(family_id).collection("ledger")
 
+def rollups_col(family_id: str):
+    return fam_ref(family_id).collection("rollups")
+
+def local_date(ts: int) -> datetime.date:
+    return datetime.datetime.fromtimestamp(ts + ROLLUP_UTC_OFFSET_MINUTES * 60, datetime.timezone.utc).date()
+
+def rollup_ref(family_id: str, uid: str, day: datetime.date):
+    return rollups_col(family_id).document(f"{uid}_{day.isoformat()}")
+
+def timeseries_ref(family_id: str, uid: str, day: datetime.date):
+    return fam_ref(family_id).collection("timeseries").document(f"{uid}_{day.isoformat()}")
+
+def record_point(txn, family_id: str, uid: str, balance_gb, minutes):
+    """
+    Append a (ts, balance, minutes) point to the kid's bucket for today.
+    Pass the open transaction so the point commits with the wallet write; txn=None writes directly.
+    """
+    ts = now_ts()
+    day = local_date(ts)
+    ref = timeseries_ref(family_id, uid, day)
+    data = {
+        "kidUid": uid,
+        "day": day.isoformat(),
+        "p": firestore.ArrayUnion([{"t": ts, "b": clamp_money(balance_gb or 0.0), "m": int(minutes or 0)}]),
+        "updatedTs": ts
+    }
+    if txn is None:
+        ref.set(data, merge=True)
+    else:
+        txn.set(ref, data, merge=True)
+
+def delete_in_batches(refs) -> int:
+    """Delete document refs in batched commits of FIRESTORE_BATCH_SIZE. Returns count deleted."""
+    deleted = 0
+    batch, pending = db.batch(), 0
+    for ref in refs:
+        batch.delete(ref)
+        pending += 1
+        if pending >= FIRESTORE_BATCH_SIZE:
+            batch.commit()
+            deleted += pending
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+        deleted += pending
+    return deleted
+
+def run_concurrently(*calls):
+    """
+    Run independent zero-arg callables on the I/O pool and return their results in order.
+    Callables must not touch flask.request (pool threads have no request context).
+    """
+    if len(calls) <= 1:
+        return [fn() for fn in calls]
+    tr = current_trace()
+    futures = [io_pool.submit(with_trace, tr, fn) for fn in calls]
+    return [f.result() for f in futures]
+
+def get_docs(refs: list) -> list:
+    """Fetch several documents in one batched RPC; snapshots come back in the order of refs."""
+    if not refs:
+        return []
+    by_path = {snap.reference.path: snap for snap in db.get_all(refs)}
+    return [by_path[ref.path] for ref in refs]
+
+def find_kid_uid(family_id: str, kid_name: str) -> str:
+    matches = fam_ref(family_id).collection("members").where("role", "==", "kid").where("name", "==", kid_name).limit(1).get()
+    return matches[0].id if matches else None
+
+# -------------------------
+# Transactions (per-document serialization, retry, telemetry)
+# -------------------------
+class KeyedLocks:
+    """One lock per key, created on demand and dropped once nobody holds or waits on it."""
+    def __init__(self):
+        self._locks = {}  # key -> [lock, holders + waiters]
+        self._guard = threading.Lock()
+
+    @contextmanager
+    def hold(self, key: str):
+        """Acquire the lock for key; yields seconds spent waiting."""
+        with self._guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        t0 = time.perf_counter()
+        entry[0].acquire()
+        try:
+            yield time.perf_counter() - t0
+        finally:
+            entry[0].release()
+            with self._guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+doc_locks = KeyedLocks()
+
+_txn_stats = {}
+_txn_stats_lock = threading.Lock()
+
+def record_txn_stats(label: str, attempts: int, aborts: int, gave_up: bool, lock_wait: float, elapsed: float):
+    with _txn_stats_lock:
+        st = _txn_stats.setdefault(label, {
+            "txns": 0, "attempts": 0, "aborts": 0, "retries": 0, "failures": 0,
+            "lock_wait_ms_total": 0.0, "lock_wait_ms_max": 0.0, "txn_ms_total": 0.0, "txn_ms_max": 0.0
+        })
+        st["txns"] += 1
+        st["attempts"] += attempts
+        st["aborts"] += aborts
+        st["retries"] += attempts - 1
+        st["failures"] += 1 if gave_up else 0
+        st["lock_wait_ms_total"] += lock_wait * 1000
+        st["lock_wait_ms_max"] = max(st["lock_wait_ms_max"], lock_wait * 1000)
+        st["txn_ms_total"] += elapsed * 1000
+        st["txn_ms_max"] = max(st["txn_ms_max"], elapsed * 1000)
+
+def txn_metrics() -> dict:
+    with _txn_stats_lock:
+        out = {}
+        for label, st in _txn_stats.items():
+            row = {k: (round(v, 1) if isinstance(v, float) else v) for k, v in st.items()}
+            row["abort_rate"] = round(st["aborts"] / st["attempts"], 3) if st["attempts"] else 0.0
+            row["lock_wait_ms_avg"] = round(st["lock_wait_ms_total"] / st["txns"], 1)
+            row["txn_ms_avg"] = round(st["txn_ms_total"] / st["txns"], 1)
+            out[label] = row
+        return out
+
+class TxnBusy(Exception):
+    """A transaction was still losing to contention after TXN_MAX_ATTEMPTS attempts."""
+
+@app.errorhandler(TxnBusy)
+def txn_busy_response(e):
+    resp = jsonify({"ok": False, "error": "Busy, please retry", "retryable": True})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = "1"
+    return resp
+
+def is_txn_contention(e: Exception) -> bool:
+    from google.api_core import exceptions as gexc
+    if isinstance(e, gexc.Aborted):
+        return True
+    # A transaction that exhausts its attempts raises ValueError chained from the Aborted
+    return isinstance(e, ValueError) and isinstance(e.__cause__, gexc.Aborted)
+
+def txn_backoff(attempt: int) -> float:
+    cap = min(TXN_BACKOFF_MAX_MS, TXN_BACKOFF_BASE_MS * (2 ** (attempt - 1)))
+    return (cap / 2 + random.uniform(0, cap / 2)) / 1000
+
+def txn_get(txn, ref):
+    """Read one document inside a transaction (Transaction.get yields snapshots)."""
+    return next(iter(txn.get(ref)))
+
+def run_txn(txn_op, lock_key: str = None, label: str = None):
+    """
+    Run txn_op(txn) in a Firestore transaction and return its result.
+    lock_key (a document path) serializes callers in this process that write the same document.
+    Contention aborts are retried by the client library, up to TXN_MAX_ATTEMPTS attempts; each retry
+    begins with the aborted transaction's id so it keeps its spot in line, and waits a jittered
+    backoff before re-running txn_op. Giving up raises TxnBusy (503). Errors raised by txn_op itself
+    (e.g. ValueError("Not enough GB$")) propagate unchanged.
+    """
+    label = label or (request.endpoint if has_request_context() else None) or "background"
+    lock = doc_locks.hold(lock_key) if (lock_key and WALLET_LOCKS) else nullcontext(0.0)
+    attempts = 0
+
+    def attempt(txn):
+        nonlocal attempts
+        attempts += 1
+        if attempts > 1:
+            time.sleep(txn_backoff(attempts - 1))
+        return txn_op(txn)
+
+    with lock as lock_wait:
+        t0 = time.perf_counter()
+        gave_up = False
+        try:
+            return firestore.transactional(attempt)(db.transaction(max_attempts=TXN_MAX_ATTEMPTS))
+        except Exception as e:
+            if not is_txn_contention(e):
+                raise
+            gave_up = True
+            raise TxnBusy(f"{label}: gave up after {attempts} attempts") from e
+        finally:
+            aborts = attempts if gave_up else max(0, attempts - 1)
+            record_txn_stats(label, attempts, aborts, gave_up, lock_wait, time.perf_counter() - t0)
+
+def resolve_cursor(col):
+    """Turn ?cursor=<doc id> into a snapshot to resume after. Returns (snapshot, error)."""
+    cursor = (request.args.get("cursor") or "").strip()
+    if not cursor:
+        return None, None
+    snap = col.document(cursor).get()
+    if not snap.exists:
+        return None, "Unknown cursor"
+    return snap, None
+
+@traced("get_family_config")
 def get_family_config(family_id: str) -> dict:
     snap = fam_ref(family_id).get()
     if not snap.exists:
@@ -147,27 +704,64 @@ def get_family_config(family_id: str) -> dict:
     data = snap.to_dict()
     return data.get("config")
 
+def read_member_counters(txn, family_id: str, fam_data: dict) -> dict:
+    """
+    memberCount / adminCount / firstAdminUid as kept on the family doc.
+    Families created before the counters existed are counted once here; the caller's
+    txn.update of the returned dict stores them.
+    """
+    if "memberCount" in fam_data and "adminCount" in fam_data:
+        return {
+            "memberCount": int(fam_data.get("memberCount") or 0),
+            "adminCount": int(fam_data.get("adminCount") or 0),
+            "firstAdminUid": fam_data.get("firstAdminUid")
+        }
+    # Transaction.get takes a DocumentReference or a Query, not a bare CollectionReference
+    members = list(txn.get(fam_ref(family_id).collection("members").select(["role"])))
+    admins = [m.id for m in members if (m.to_dict() or {}).get("role") == "admin"]
+    return {"memberCount": len(members), "adminCount": len(admins), "firstAdminUid": admins[0] if admins else None}
+
+def other_admin_uid(txn, family_id: str, exclude_uid: str) -> str:
+    """Another admin to cache as firstAdminUid when the cached one leaves (reads at most 2 docs)."""
+    admins = fam_ref(family_id).collection("members").where("role", "==", "admin").limit(2)
+    for snap in txn.get(admins):
+        if snap.id != exclude_uid:
+            return snap.id
+    return None
+
 def is_admin(family_id: str, uid: str) -> bool:
     snap = member_ref(family_id, uid).get()
     if not snap.exists:
         return False
     return snap.to_dict().get("role") == "admin"
 
+@traced("get_role")
 def get_role(family_id: str, uid: str) -> str:
     snap = member_ref(family_id, uid).get()
     if not snap.exists:
         return None
     return snap.to_dict().get("role")
 
-def ledger_add(family_id: str, actor_uid: str, target_uid: str, typ: str, payload: dict):
+def ledger_heads_col(family_id: str):
+    return fam_ref(family_id).collection("ledgerHeads")
+
+def latest_ledger_hash(family_id: str) -> str:
+    last = ledger_col(family_id).order_by("ts", direction=firestore.Query.DESCENDING).limit(1).get()
+    return last[0].to_dict().get("hash") if last else GENESIS_HASH
+
+@traced("ledger_add")
+def ledger_add(family_id: str, actor_uid: str, target_uid: str, typ: str, payload: dict, doc_id: str = None):
+    """Append an event. With doc_id the append is write-once: if that event already exists nothing is written."""
     payload_json = json.dumps(payload, separators=(",", ":"), sort_keys=True)
+    if LEDGER_SHARDED:
+        ledger_add_sharded(family_id, actor_uid, target_uid, typ, payload, payload_json, doc_id)
+        return
     # find last hash
-    last = ledger_col(family_id).order_by("ts", direction=firestore.Query.DESCENDING).limit(1).get()
-    prev_hash = last[0].to_dict().get("hash") if last else "0"*64
+    prev_hash = latest_ledger_hash(family_id)
     ts = now_ts()
     h = compute_ledger_hash(ts, actor_uid or "", target_uid or "", typ, payload_json, prev_hash)
 
-    ledger_col(family_id).add({
+    entry = {
         "ts": ts,
         "actorUid": actor_uid or "",
         "targetUid": target_uid or "",
@@ -176,7 +770,85 @@ def ledger_add(family_id: str, actor_uid: str, target_uid: str, typ: str, payloa
         "payloadJson": payload_json,
         "prevHash": prev_hash,
         "hash": h
-    })
+    }
+    if not doc_id:
+        ledger_col(family_id).add(entry)
+        return
+    from google.api_core.exceptions import AlreadyExists
+    try:
+        ledger_col(family_id).document(doc_id).create(entry)
+    except AlreadyExists:
+        pass
+
+def ledger_add_sharded(family_id: str, actor_uid: str, target_uid: str, typ: str, payload: dict, payload_json: str,
+                       doc_id: str = None):
+    """Append to the target member's sub-chain; the chain head is read and advanced in one transaction."""
+    chain = target_uid or FAMILY_CHAIN
+    head_ref = ledger_heads_col(family_id).document(chain)
+    entry_ref = ledger_col(family_id).document(doc_id) if doc_id else ledger_col(family_id).document()
+    # The family chain continues from the unsharded ledger the first time sharding is switched on
+    seed_hash = latest_ledger_hash(family_id) if chain == FAMILY_CHAIN and not head_ref.get().exists else GENESIS_HASH
+
+    def txn_op(txn):
+        if doc_id and txn_get(txn, entry_ref).exists:
+            return
+        head = txn_get(txn, head_ref).to_dict() or {}
+        prev_hash = head.get("hash") or seed_hash
+        seq = int(head.get("seq") or 0) + 1
+        ts = now_ts()
+        h = compute_ledger_hash(ts, actor_uid or "", target_uid or "", typ, payload_json, prev_hash)
+        txn.set(entry_ref, {
+            "ts": ts,
+            "actorUid": actor_uid or "",
+            "targetUid": target_uid or "",
+            "type": typ,
+            "payload": payload,
+            "payloadJson": payload_json,
+            "prevHash": prev_hash,
+            "hash": h,
+            "chain": chain,
+            "seq": seq
+        })
+        txn.set(head_ref, {"chain": chain, "hash": h, "seq": seq, "ts": ts})
+
+    run_txn(txn_op, lock_key=head_ref.path)
+    if chain != FAMILY_CHAIN:
+        maybe_anchor_ledger(family_id)
+
+_anchor_lock = threading.Lock()
+_last_anchor = {}  # family_id -> (ts, heads signature) of the last anchor written by this process
+
+def anchor_ledger(family_id: str, force: bool = False) -> dict:
+    """
+    Fold every member chain head into one ANCHOR entry on the family chain.
+    The anchor's hash covers all heads, giving a verifiable global ordering point across sub-chains.
+    Returns the anchored heads, or None when nothing moved since the last anchor.
+    """
+    heads = {}
+    for snap in ledger_heads_col(family_id).stream():
+        if snap.id == FAMILY_CHAIN:
+            continue
+        d = snap.to_dict()
+        heads[snap.id] = {"seq": int(d.get("seq") or 0), "hash": d.get("hash")}
+    signature = sha256(json.dumps(heads, sort_keys=True))
+
+    with _anchor_lock:
+        _, last_sig = _last_anchor.get(family_id, (0, None))
+        if not heads or (signature == last_sig and not force):
+            _last_anchor[family_id] = (now_ts(), last_sig)
+            return None
+        _last_anchor[family_id] = (now_ts(), signature)
+
+    ledger_add(family_id, "", "", "ANCHOR", {"heads": heads})
+    return heads
+
+def maybe_anchor_ledger(family_id: str):
+    with _anchor_lock:
+        last_ts, last_sig = _last_anchor.get(family_id, (0, None))
+        if now_ts() - last_ts < LEDGER_ANCHOR_INTERVAL:
+            return
+        _last_anchor[family_id] = (now_ts(), last_sig)
+    anchor_ledger(family_id)
 
 # -------------------------
 # Auth middleware (Firebase ID token)
@@ -228,13 +900,179 @@ def auth_required(roles=None, allow_bootstrap=False):
         return wrapper
     return deco
 
+# -------------------------
+# Idempotency-Key support for mutating endpoints
+# -------------------------
+class TTLCache:
+    """Thread-safe LRU map whose entries also expire after ttl seconds."""
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value, expires: float = None):
+        with self._lock:
+            self._data[key] = (expires or time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+idempotency_cache = TTLCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL_SECONDS)
+
+class IdempotentReplay(Exception):
+    """Raised inside a transaction when another request already committed this key."""
+    def __init__(self, stored: dict):
+        super().__init__("idempotent replay")
+        self.stored = stored
+
+def idempotency_ref(family_id: str, doc_id: str):
+    return fam_ref(family_id).collection("idempotency").document(doc_id)
+
+def request_fingerprint() -> str:
+    """Hash of the request body (canonical JSON when it parses), stored with the key's response."""
+    data = request.get_json(force=True, silent=True)
+    if data is None:
+        return hashlib.sha256(request.get_data()).hexdigest()
+    return sha256(json.dumps(data, sort_keys=True, separators=(",", ":")))
+
+def replay_response(stored: dict):
+    resp = jsonify(stored["response"])
+    resp.status_code = int(stored.get("status") or 200)
+    resp.headers["Idempotent-Replayed"] = "true"
+    return resp
+
+def idempotent(fn):
+    """
+    Honor an Idempotency-Key header (use below @auth_required).
+    A repeated key returns the stored response without re-running the handler, or 422 if the
+    body differs from the one the key was first used with. The handler's
+    transaction must call idempotency_guard(txn) first and idempotency_record(txn, body, ledger=event)
+    last, so the record commits atomically with the wallet write, and write the ledger event with
+    ledger_add_after_commit. If that write fails, the record still says ledgerPending and the
+    replay finishes it before answering.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        request.idempotency = None
+        key = request.headers.get("Idempotency-Key", "").strip()
+        if not key:
+            return fn(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({"ok": False, "error": "Idempotency-Key too long"}), 400
+
+        family_id = request.user["family_id"]
+        doc_id = sha256(f"{request.user['uid']}|{request.endpoint}|{key}")
+        cache_key = f"{family_id}/{doc_id}"
+        fingerprint = request_fingerprint()
+
+        def replay(stored):
+            # Keys stored before requestHash existed replay as before
+            if stored.get("requestHash") not in (None, fingerprint):
+                return jsonify({"ok": False, "error": "Idempotency-Key was already used with a different request body"}), 422
+            if stored.get("ledgerPending"):
+                stored = finish_pending_ledger(family_id, doc_id, stored)
+            idempotency_cache.put(cache_key, stored, expires=stored["expiresTs"])
+            return replay_response(stored)
+
+        stored = idempotency_cache.get(cache_key)
+        if stored is None:
+            snap = idempotency_ref(family_id, doc_id).get()
+            if snap.exists and int(snap.to_dict().get("expiresTs") or 0) > now_ts():
+                stored = snap.to_dict()
+        if stored is not None:
+            return replay(stored)
+
+        request.idempotency = {"ref": idempotency_ref(family_id, doc_id), "cache_key": cache_key,
+                               "fingerprint": fingerprint, "ledger_id": f"idem-{doc_id}", "record": None}
+        try:
+            result = fn(*args, **kwargs)
+        except IdempotentReplay as e:
+            return replay(e.stored)
+
+        record = request.idempotency["record"]
+        if record is not None:
+            idempotency_cache.put(cache_key, record, expires=record["expiresTs"])
+        return result
+    return wrapper
+
+def idempotency_guard(txn):
+    """Transactional re-check of the key; raises IdempotentReplay if it already committed."""
+    idem = getattr(request, "idempotency", None)
+    if not idem:
+        return
+    snap = txn_get(txn, idem["ref"])
+    if snap.exists and int(snap.to_dict().get("expiresTs") or 0) > now_ts():
+        raise IdempotentReplay(snap.to_dict())
+
+def idempotency_record(txn, body: dict, status: int = 200, ledger: dict = None):
+    """
+    Store the response for this key in the same commit as the handler's writes.
+    ledger is the event (see ledger_event) the handler appends after the commit; it's kept with
+    ledgerPending=True until ledger_add_after_commit clears it.
+    """
+    idem = getattr(request, "idempotency", None)
+    if not idem:
+        return
+    ts = now_ts()
+    record = {
+        "uid": request.user["uid"],
+        "endpoint": request.endpoint,
+        "status": status,
+        "response": body,
+        "requestHash": idem["fingerprint"],
+        "ts": ts,
+        "expiresTs": ts + IDEMPOTENCY_TTL_SECONDS,
+        # Timestamp field so a Firestore TTL policy on idempotency.expiresAt can purge old keys
+        "expiresAt": datetime.datetime.fromtimestamp(ts + IDEMPOTENCY_TTL_SECONDS, datetime.timezone.utc)
+    }
+    if ledger is not None:
+        record.update(ledger=ledger, ledgerId=idem["ledger_id"], ledgerPending=True)
+    txn.set(idem["ref"], record)
+    idem["record"] = record
+
+def ledger_event(actor_uid: str, target_uid: str, typ: str, payload: dict) -> dict:
+    return {"actorUid": actor_uid, "targetUid": target_uid, "type": typ, "payload": payload}
+
+def ledger_add_after_commit(family_id: str, event: dict):
+    """
+    Append a handler's ledger event once its transaction has committed. Under an Idempotency-Key
+    the event id is derived from the key, so finishing it again on replay can't write it twice.
+    """
+    idem = getattr(request, "idempotency", None)
+    if not idem or idem["record"] is None:
+        ledger_add(family_id, event["actorUid"], event["targetUid"], event["type"], event["payload"])
+        return
+    ledger_add(family_id, event["actorUid"], event["targetUid"], event["type"], event["payload"], doc_id=idem["ledger_id"])
+    idem["ref"].update({"ledgerPending": False})
+    idem["record"]["ledgerPending"] = False
+
+def finish_pending_ledger(family_id: str, doc_id: str, stored: dict) -> dict:
+    """Write the ledger event a key's first request committed but didn't get to append."""
+    event = stored["ledger"]
+    ledger_add(family_id, event["actorUid"], event["targetUid"], event["type"], event["payload"], doc_id=stored["ledgerId"])
+    idempotency_ref(family_id, doc_id).update({"ledgerPending": False})
+    return dict(stored, ledgerPending=False)
+
 # -------------------------
 # Static: serve index.html and images
 # -------------------------
 @app.get("/")
 def index():
     # If you keep your index.html next to app.py for local testing
-    return send_from_directory(APP_DIR, "index.html")
+    return send_precompressed(APP_DIR, "index.html")
 
 @app.route("/test-image", methods=["GET"])
 def test_image():
@@ -277,7 +1115,7 @@ def serve_image(filename):
         
         print(f"[IMAGE] OK Serving: {filename}", flush=True)
         app.logger.info(f"[IMAGE] OK Serving: {filename}")
-        return send_from_directory(images_dir, filename)
+        return send_precompressed(images_dir, filename)
     except Exception as e:
         print(f"[IMAGE] Error serving {filename}: {e}", flush=True)
         app.logger.error(f"[IMAGE] Error serving {filename}: {e}")
@@ -319,7 +1157,11 @@ def api_setup_family():
         doc.set({
             "name": name,
             "createdTs": now_ts(),
-            "config": cfg
+            "config": cfg,
+            "catalogVersion": 1,
+            "memberCount": 0,
+            "adminCount": 0,
+            "firstAdminUid": None
         })
 
         # Genesis ledger
@@ -354,95 +1196,114 @@ def api_bootstrap():
     uid = request.user["uid"]
     email = request.user.get("email", "")
     
-    # Check if already registered
-    if get_role(family_id, uid) is not None:
-        return jsonify({"ok": True, "role": get_role(family_id, uid), "message": "Already registered"})
+    # Check if already registered (auth_required already looked the role up)
+    if request.user["role"] is not None:
+        return jsonify({"ok": True, "role": request.user["role"], "message": "Already registered"})
     
     data = request.get_json(force=True) or {}
     requested_name = (data.get("name") or "").strip()
     requested_role = (data.get("role") or "").strip()
-    
-    # Check if family exists
-    if not fam_ref(family_id).get().exists:
-        return jsonify({"ok": False, "error": "Family not found"}), 404
-    
-    # Count existing members
-    members_count = len(list(fam_ref(family_id).collection("members").stream()))
-    
-    # Determine role
-    final_role = None
-    final_name = requested_name
-    
-    # Rule 1: First user becomes admin
-    if members_count == 0:
-        final_role = "admin"
-        if not final_name:
-            final_name = "Admin"
-        ledger_add(family_id, "", uid, "BOOTSTRAP_FIRST_ADMIN", {"name": final_name})
-    
-    # Rule 2: Kid email pattern detection
-    elif email.endswith(f".{family_id}@gbucks.local"):
-        final_role = "kid"
-        if not final_name:
-            # Extract kid name from email: {name}.{familyId}@gbucks.local
-            parts = email.split(".")
-            if len(parts) > 0:
-                final_name = parts[0].capitalize()
-            else:
+
+    # Decide the role from the family's member counters and create member/wallet/session with the
+    # counter update in one transaction, so two first users can't both become the first admin.
+    def txn_op(txn):
+        member_snap = txn_get(txn, member_ref(family_id, uid))
+        if member_snap.exists:
+            return {"registered": member_snap.to_dict().get("role")}
+
+        fam_snap = txn_get(txn, fam_ref(family_id))
+        if not fam_snap.exists:
+            return {"error": ("Family not found", 404)}
+        counters = read_member_counters(txn, family_id, fam_snap.to_dict())
+        members_count = counters["memberCount"]
+
+        final_role = None
+        final_name = requested_name
+        event = None
+
+        # Rule 1: First user becomes admin
+        if members_count == 0:
+            final_role = "admin"
+            if not final_name:
+                final_name = "Admin"
+            event = ("", "BOOTSTRAP_FIRST_ADMIN", {"name": final_name})
+
+        # Rule 2: Kid email pattern detection
+        elif email.endswith(f".{family_id}@gbucks.local"):
+            final_role = "kid"
+            if not final_name:
+                # Extract kid name from email: {name}.{familyId}@gbucks.local
+                parts = email.split(".")
+                if len(parts) > 0:
+                    final_name = parts[0].capitalize()
+                else:
+                    final_name = "Kid"
+            event = ("", "BOOTSTRAP_KID", {"name": final_name, "email": email})
+
+        # Rule 3: Explicit admin request (only if family has members and no role specified)
+        elif requested_role == "admin" and members_count > 0:
+            # Check if there's at least one existing admin
+            if counters["adminCount"] == 0:
+                return {"error": ("Cannot create admin: no existing admin to authorize", 403)}
+            final_role = "admin"
+            if not final_name:
+                final_name = "Admin"
+            event = (counters["firstAdminUid"] or "", "BOOTSTRAP_ADMIN", {"name": final_name})
+
+        # Rule 4: Explicit kid request
+        elif requested_role == "kid":
+            final_role = "kid"
+            if not final_name:
                 final_name = "Kid"
-        ledger_add(family_id, "", uid, "BOOTSTRAP_KID", {"name": final_name, "email": email})
-    
-    # Rule 3: Explicit admin request (only if family has members and no role specified)
-    elif requested_role == "admin" and members_count > 0:
-        # Check if there's at least one existing admin
-        existing_admins = list(fam_ref(family_id).collection("members").where("role", "==", "admin").stream())
-        if len(existing_admins) == 0:
-            return jsonify({"ok": False, "error": "Cannot create admin: no existing admin to authorize"}), 403
-        final_role = "admin"
-        if not final_name:
-            final_name = "Admin"
-        ledger_add(family_id, existing_admins[0].id, uid, "BOOTSTRAP_ADMIN", {"name": final_name})
-    
-    # Rule 4: Explicit kid request
-    elif requested_role == "kid":
-        final_role = "kid"
+            # Authorized by the first admin (or system)
+            event = (counters["firstAdminUid"] or "", "BOOTSTRAP_KID_EXPLICIT", {"name": final_name})
+
+        if not final_role:
+            return {"error": ("Cannot determine role. Provide name and role, or use kid email pattern.", 400)}
+
         if not final_name:
-            final_name = "Kid"
-        # Find an admin to authorize (or use system)
-        existing_admins = list(fam_ref(family_id).collection("members").where("role", "==", "admin").stream())
-        actor_uid = existing_admins[0].id if existing_admins else ""
-        ledger_add(family_id, actor_uid, uid, "BOOTSTRAP_KID_EXPLICIT", {"name": final_name})
-    
-    if not final_role:
-        return jsonify({"ok": False, "error": "Cannot determine role. Provide name and role, or use kid email pattern."}), 400
-    
-    if not final_name:
-        return jsonify({"ok": False, "error": "Name required"}), 400
-    
-    # Create member, wallet, and session
-    member_ref(family_id, uid).set({
-        "uid": uid,
-        "name": final_name,
-        "role": final_role,
-        "createdTs": now_ts()
-    })
-    
-    wallet_ref(family_id, uid).set({
-        "balanceGb": 0.0,
-        "minutes": 0,
-        "locked": False,
-        "updatedTs": now_ts()
-    })
-    
-    session_ref(family_id, uid).set({
-        "active": False,
-        "mode": None,
-        "startTs": None,
-        "endTs": None,
-        "updatedTs": now_ts()
-    })
-    
-    return jsonify({"ok": True, "role": final_role, "name": final_name})
+            return {"error": ("Name required", 400)}
+
+        # Create member, wallet, and session
+        txn.set(member_ref(family_id, uid), {
+            "uid": uid,
+            "name": final_name,
+            "role": final_role,
+            "createdTs": now_ts()
+        })
+
+        txn.set(wallet_ref(family_id, uid), {
+            "balanceGb": 0.0,
+            "minutes": 0,
+            "locked": False,
+            "updatedTs": now_ts()
+        })
+
+        txn.set(session_ref(family_id, uid), {
+            "active": False,
+            "mode": None,
+            "startTs": None,
+            "endTs": None,
+            "updatedTs": now_ts()
+        })
+
+        counters["memberCount"] += 1
+        if final_role == "admin":
+            counters["adminCount"] += 1
+            counters["firstAdminUid"] = counters["firstAdminUid"] or uid
+        txn.update(fam_ref(family_id), counters)
+        return {"role": final_role, "name": final_name, "event": event}
+
+    result = run_txn(txn_op)
+    if "registered" in result:
+        return jsonify({"ok": True, "role": result["registered"], "message": "Already registered"})
+    if "error" in result:
+        msg, status = result["error"]
+        return jsonify({"ok": False, "error": msg}), status
+
+    actor_uid, typ, payload = result["event"]
+    ledger_add(family_id, actor_uid, uid, typ, payload)
+    return jsonify({"ok": True, "role": result["role"], "name": result["name"]})
 
 # -------------------------
 # Admin: register members (creates membership + initial wallet/session docs)
@@ -467,27 +1328,45 @@ def api_admin_add_member():
     if not uid or not name or role not in ("admin","kid"):
         return jsonify({"ok": False, "error": "uid, name, role required (role=admin|kid)"}), 400
 
-    member_ref(family_id, uid).set({
-        "uid": uid,
-        "name": name,
-        "role": role,
-        "createdTs": now_ts()
-    }, merge=True)
-
-    wallet_ref(family_id, uid).set({
-        "balanceGb": 0.0,
-        "minutes": 0,
-        "locked": False,
-        "updatedTs": now_ts()
-    }, merge=True)
-
-    session_ref(family_id, uid).set({
-        "active": False,
-        "mode": None,
-        "startTs": None,
-        "endTs": None,
-        "updatedTs": now_ts()
-    }, merge=True)
+    # Member docs and the family's member/admin counters change together
+    def txn_op(txn):
+        fam_snap = txn_get(txn, fam_ref(family_id))
+        old = txn_get(txn, member_ref(family_id, uid))
+        counters = read_member_counters(txn, family_id, fam_snap.to_dict() or {})
+        old_role = old.to_dict().get("role") if old.exists else None
+        if old_role == "admin" and role != "admin" and counters["firstAdminUid"] == uid:
+            counters["firstAdminUid"] = other_admin_uid(txn, family_id, uid)
+
+        txn.set(member_ref(family_id, uid), {
+            "uid": uid,
+            "name": name,
+            "role": role,
+            "createdTs": now_ts()
+        }, merge=True)
+
+        txn.set(wallet_ref(family_id, uid), {
+            "balanceGb": 0.0,
+            "minutes": 0,
+            "locked": False,
+            "updatedTs": now_ts()
+        }, merge=True)
+
+        txn.set(session_ref(family_id, uid), {
+            "active": False,
+            "mode": None,
+            "startTs": None,
+            "endTs": None,
+            "updatedTs": now_ts()
+        }, merge=True)
+
+        if not old.exists:
+            counters["memberCount"] += 1
+        counters["adminCount"] += (role == "admin") - (old_role == "admin")
+        if role == "admin" and not counters["firstAdminUid"]:
+            counters["firstAdminUid"] = uid
+        txn.update(fam_ref(family_id), counters)
+
+    run_txn(txn_op)
 
     ledger_add(family_id, request.user["uid"], uid, "ADD_MEMBER", {"name": name, "role": role})
     return jsonify({"ok": True})
@@ -507,28 +1386,143 @@ def api_admin_remove_member():
     if not uid:
         return jsonify({"ok": False, "error": "uid required"}), 400
     
-    # Get member info before deletion
-    member_snap = member_ref(family_id, uid).get()
-    if not member_snap.exists:
+    job_ref = purge_jobs_col(family_id).document()
+
+    # Checks, the member/wallet/session deletes, the counter update and the purge job record commit together
+    def txn_op(txn):
+        member_snap = txn_get(txn, member_ref(family_id, uid))
+        if not member_snap.exists:
+            return None
+        member_data = member_snap.to_dict()
+        fam_snap = txn_get(txn, fam_ref(family_id))
+        counters = read_member_counters(txn, family_id, fam_snap.to_dict() or {})
+
+        # Don't allow removing the last admin
+        if member_data.get("role") == "admin":
+            if counters["adminCount"] <= 1:
+                raise ValueError("Cannot remove last admin")
+            counters["adminCount"] -= 1
+            if counters["firstAdminUid"] == uid:
+                counters["firstAdminUid"] = other_admin_uid(txn, family_id, uid)
+        counters["memberCount"] = max(0, counters["memberCount"] - 1)
+
+        txn.update(fam_ref(family_id), counters)
+        txn.delete(member_ref(family_id, uid))
+        txn.delete(wallet_ref(family_id, uid))
+        txn.delete(session_ref(family_id, uid))
+        txn.set(job_ref, new_purge_job(uid))
+        return member_data
+
+    try:
+        member_data = run_txn(txn_op)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    if member_data is None:
         return jsonify({"ok": False, "error": "Member not found"}), 404
-    
-    member_data = member_snap.to_dict()
+
     member_name = member_data.get("name", uid)
     member_role = member_data.get("role", "unknown")
-    
-    # Don't allow removing the last admin
-    if member_role == "admin":
-        admin_count = len(list(fam_ref(family_id).collection("members").where("role", "==", "admin").stream()))
-        if admin_count <= 1:
-            return jsonify({"ok": False, "error": "Cannot remove last admin"}), 400
-    
-    # Delete member, wallet, and session
-    member_ref(family_id, uid).delete()
-    wallet_ref(family_id, uid).delete()
-    session_ref(family_id, uid).delete()
-    
-    ledger_add(family_id, request.user["uid"], uid, "REMOVE_MEMBER", {"name": member_name, "role": member_role})
-    return jsonify({"ok": True, "message": f"Member {member_name} removed"})
+
+    # Purchases, rollups and time series are deleted in the background; the ledger is kept for audit
+    start_purge_job(family_id, job_ref.id)
+    ledger_add(family_id, request.user["uid"], uid, "REMOVE_MEMBER", {"name": member_name, "role": member_role, "purge_job": job_ref.id})
+    return jsonify({"ok": True, "message": f"Member {member_name} removed", "purge_job_id": job_ref.id})
+
+# -------------------------
+# Background purge of a removed member's history
+# -------------------------
+purge_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="purge")
+_active_purges = set()
+_active_purges_lock = threading.Lock()
+
+def purge_jobs_col(family_id: str):
+    return fam_ref(family_id).collection("purgeJobs")
+
+# Per-kid subcollections outside members/wallets/sessions, and the field naming the kid
+PURGE_TARGETS = [("purchases", "kidUid"), ("rollups", "kidUid"), ("timeseries", "kidUid"), ("idempotency", "uid")]
+
+def new_purge_job(uid: str) -> dict:
+    return {
+        "kidUid": uid,
+        "status": "queued",
+        "deleted": {name: 0 for name, _ in PURGE_TARGETS},
+        "createdTs": now_ts(),
+        "updatedTs": now_ts(),
+        "error": None
+    }
+
+def run_purge_job(family_id: str, job_id: str):
+    """
+    Delete the kid's documents PURGE_BATCH_SIZE at a time. Each batch also bumps the job's progress
+    counters, so progress is exact and a restarted job simply continues with whatever is left.
+    """
+    job_ref = purge_jobs_col(family_id).document(job_id)
+    try:
+        job = job_ref.get().to_dict() or {}
+        uid = job.get("kidUid")
+        if not uid or job.get("status") == "done":
+            return
+        job_ref.update({"status": "running", "error": None, "updatedTs": now_ts()})
+        for name, field in PURGE_TARGETS:
+            query = fam_ref(family_id).collection(name).where(field, "==", uid)
+            while True:
+                snaps = query.limit(PURGE_BATCH_SIZE).get()
+                if not snaps:
+                    break
+                batch = db.batch()
+                for snap in snaps:
+                    batch.delete(snap.reference)
+                batch.update(job_ref, {f"deleted.{name}": firestore.Increment(len(snaps)), "updatedTs": now_ts()})
+                batch.commit()
+        job_ref.update({"status": "done", "updatedTs": now_ts(), "finishedTs": now_ts()})
+    except Exception as e:
+        app.logger.error(f"[PURGE] job {family_id}/{job_id} failed: {e}")
+        job_ref.update({"status": "error", "error": str(e)[:500], "updatedTs": now_ts()})
+    finally:
+        with _active_purges_lock:
+            _active_purges.discard((family_id, job_id))
+
+def start_purge_job(family_id: str, job_id: str) -> bool:
+    """Queue a purge job on this process's purge worker unless it is already queued here."""
+    with _active_purges_lock:
+        if (family_id, job_id) in _active_purges:
+            return False
+        _active_purges.add((family_id, job_id))
+    purge_pool.submit(run_purge_job, family_id, job_id)
+    return True
+
+@app.get("/api/admin/purge_status")
+@auth_required(["admin"])
+def api_admin_purge_status():
+    """
+    Progress of a member purge started by remove_member.
+    Query: ?job_id=<purge_job_id>
+    A job that stalled (e.g. the instance was recycled) or failed is restarted by this call.
+    """
+    family_id = request.user["family_id"]
+    job_id = (request.args.get("job_id") or "").strip()
+    if not job_id:
+        return jsonify({"ok": False, "error": "job_id required"}), 400
+
+    snap = purge_jobs_col(family_id).document(job_id).get()
+    if not snap.exists:
+        return jsonify({"ok": False, "error": "Purge job not found"}), 404
+    job = snap.to_dict()
+
+    restarted = False
+    stalled = now_ts() - int(job.get("updatedTs") or 0) > PURGE_STALE_SECONDS
+    if job.get("status") == "error" or (job.get("status") in ("queued", "running") and stalled):
+        restarted = start_purge_job(family_id, job_id)
+
+    return jsonify({
+        "ok": True,
+        "job_id": job_id,
+        "kid_user_id": job.get("kidUid"),
+        "status": job.get("status"),
+        "deleted": job.get("deleted") or {},
+        "error": job.get("error"),
+        "restarted": restarted
+    })
 
 @app.post("/api/admin/reset_kid")
 @auth_required(["admin"])
@@ -567,6 +1561,7 @@ def api_admin_reset_kid():
         "locked": locked,
         "updatedTs": now_ts()
     })
+    record_point(None, family_id, uid, balance_gb, minutes)
     
     # Reset session
     session_ref(family_id, uid).set({
@@ -589,81 +1584,255 @@ def api_admin_reset_kid():
 # -------------------------
 # Catalog & State
 # -------------------------
+# Every catalog edit bumps the family's catalogVersion and stamps the edited item with it as "rev";
+# removals leave a {section, id, rev} tombstone in catalogRemoved. Versions start at 1 (families from
+# before versioning read as 1), so since=0 always means "no cache"; items without a rev count as rev 0
+# and only travel in full syncs.
+CATALOG_SECTIONS = ("rewards", "screen", "food", "time_consequences", "money_consequences")
+
+# Fields the purchase/reward/consequence handlers read from each section's items
+CATALOG_REQUIRED = {
+    "rewards": ("label", "delta_gb"),
+    "screen": ("label", "cost_gb", "minutes"),
+    "food": ("label", "category", "cost_gb"),
+    "time_consequences": ("label",),
+    "money_consequences": ("label", "delta_gb"),
+}
+CATALOG_FIELD_CHECKS = {
+    "label": (lambda v: isinstance(v, str) and v.strip() != "", "a non-empty string"),
+    "category": (lambda v: isinstance(v, str) and v.strip() != "", "a non-empty string"),
+    "image_url": (lambda v: isinstance(v, str), "a string"),
+    "delta_gb": (lambda v: isinstance(v, (int, float)) and not isinstance(v, bool), "a number"),
+    "cost_gb": (lambda v: isinstance(v, (int, float)) and not isinstance(v, bool) and v >= 0, "a number >= 0"),
+    "minutes": (lambda v: isinstance(v, int) and not isinstance(v, bool) and v > 0, "an integer > 0"),
+    "delta_minutes": (lambda v: isinstance(v, int) and not isinstance(v, bool), "an integer"),
+    "set_minutes": (lambda v: isinstance(v, int) and not isinstance(v, bool) and v >= 0, "an integer >= 0"),
+    "lock": (lambda v: isinstance(v, bool), "true or false"),
+}
+
+def catalog_item_error(section: str, item: dict) -> str:
+    """Why item can't be stored in section, or None if it's usable by that section's handler."""
+    for field in CATALOG_REQUIRED[section]:
+        if field not in item:
+            return f"{section} items need {', '.join(CATALOG_REQUIRED[section])}"
+    if section == "time_consequences" and not any(k in item for k in ("delta_minutes", "set_minutes", "lock")):
+        return "time_consequences items need one of delta_minutes, set_minutes, lock"
+    for field, (ok, what) in CATALOG_FIELD_CHECKS.items():
+        if field in item and not ok(item[field]):
+            return f"{field} must be {what}"
+    return None
+
+@traced("get_catalog")
+def get_catalog(family_id: str) -> dict:
+    snap = fam_ref(family_id).get()
+    if not snap.exists:
+        return None
+    data = snap.to_dict()
+    return {
+        "config": data.get("config") or {},
+        "version": max(1, int(data.get("catalogVersion") or 0)),
+        "floor": int(data.get("catalogFloor") or 0),
+        "removed": data.get("catalogRemoved") or []
+    }
+
+def catalog_delta(cat: dict, since: int) -> dict:
+    """Items changed and removed after version `since`, or the full config if it can't be served as a delta."""
+    if since <= 0 or since < cat["floor"] or since > cat["version"]:
+        return {"full": True, "config": cat["config"]}
+    changed = {}
+    for section in CATALOG_SECTIONS:
+        items = [i for i in (cat["config"].get(section) or []) if int(i.get("rev") or 0) > since]
+        if items:
+            changed[section] = items
+    removed = [{"section": t["section"], "id": t["id"]} for t in cat["removed"] if t["rev"] > since]
+    return {"full": False, "changed": changed, "removed": removed}
+
 @app.get("/api/catalog")
 @auth_required(["admin","kid"])
 def api_catalog():
-    cfg = get_family_config(request.user["family_id"])
-    if not cfg:
+    cat = get_catalog(request.user["family_id"])
+    if not cat:
         return jsonify({"ok": False, "error": "Family not found"}), 404
-    return jsonify({"ok": True, "config": cfg})
+    return jsonify({"ok": True, "version": cat["version"], "config": cat["config"]})
+
+@app.get("/api/catalog/delta")
+@auth_required(["admin","kid"])
+def api_catalog_delta():
+    """
+    Catalog changes since the client's cached version.
+    Query:
+    ?since=12
+
+    Returns one of:
+    { ok:true, version:12, unchanged:true }
+    { ok:true, version:15, full:false, changed:{ "food":[{...,"rev":14}] }, removed:[{section,id}] }
+    { ok:true, version:15, full:true, config:{...} }   (since absent/0 = no cache, or too old to diff)
+    """
+    try:
+        since = int(request.args.get("since") or 0)
+    except ValueError:
+        return jsonify({"ok": False, "error": "since must be an integer"}), 400
+
+    cat = get_catalog(request.user["family_id"])
+    if not cat:
+        return jsonify({"ok": False, "error": "Family not found"}), 404
+    if since > 0 and since == cat["version"]:
+        return jsonify({"ok": True, "version": since, "unchanged": True})
+    return jsonify({"ok": True, "version": cat["version"], **catalog_delta(cat, since)})
+
+@app.post("/api/admin/catalog")
+@auth_required(["admin"])
+def api_admin_catalog():
+    """
+    Admin adds/replaces or removes one catalog item.
+    Body:
+    { "section":"food", "item":{"id":"d_pizza","category":"Dinner","label":"Pizza","cost_gb":6.00} }
+    { "section":"food", "remove":"d_pizza" }
+
+    Returns:
+    { ok:true, version:16 }
+    """
+    family_id = request.user["family_id"]
+    data = request.get_json(force=True)
+    section = (data.get("section") or "").strip()
+    item = data.get("item")
+    remove_id = (data.get("remove") or "").strip()
+
+    if section not in CATALOG_SECTIONS:
+        return jsonify({"ok": False, "error": f"section must be one of {', '.join(CATALOG_SECTIONS)}"}), 400
+    if item is not None and remove_id:
+        return jsonify({"ok": False, "error": "Send either item or remove, not both"}), 400
+    if item is not None:
+        if not isinstance(item, dict) or not str(item.get("id") or "").strip():
+            return jsonify({"ok": False, "error": "item must be an object with an id"}), 400
+        item = dict(item, id=str(item["id"]).strip())
+        err = catalog_item_error(section, item)
+        if err:
+            return jsonify({"ok": False, "error": err}), 400
+    elif not remove_id:
+        return jsonify({"ok": False, "error": "item or remove required"}), 400
+    item_id = item["id"] if item is not None else remove_id
+
+    # The config, version and tombstones live on the family doc and change together
+    def txn_op(txn):
+        fam_snap = txn_get(txn, fam_ref(family_id))
+        if not fam_snap.exists:
+            raise LookupError("Family not found")
+        fam_data = fam_snap.to_dict()
+        cfg = fam_data.get("config") or {}
+        version = max(1, int(fam_data.get("catalogVersion") or 0)) + 1
+        floor = int(fam_data.get("catalogFloor") or 0)
+        removed = [t for t in (fam_data.get("catalogRemoved") or [])
+                   if not (t["section"] == section and t["id"] == item_id)]
+        items = list(cfg.get(section) or [])
+        pos = next((n for n, i in enumerate(items) if i.get("id") == item_id), None)
+
+        if item is not None:
+            item["rev"] = version
+            if pos is None:
+                items.append(item)
+            else:
+                items[pos] = item
+        else:
+            if pos is None:
+                raise LookupError("Item not found")
+            del items[pos]
+            removed.append({"section": section, "id": remove_id, "rev": version})
+            if len(removed) > CATALOG_TOMBSTONE_MAX:
+                # Versions before the oldest dropped tombstone can no longer be diffed
+                floor = max(floor, removed[-CATALOG_TOMBSTONE_MAX - 1]["rev"])
+                removed = removed[-CATALOG_TOMBSTONE_MAX:]
+
+        txn.update(fam_ref(family_id), {
+            f"config.{section}": items,
+            "catalogVersion": version,
+            "catalogFloor": floor,
+            "catalogRemoved": removed
+        })
+        return version
+
+    try:
+        version = run_txn(txn_op, lock_key=fam_ref(family_id).path, label="catalog")
+    except LookupError as e:
+        return jsonify({"ok": False, "error": str(e)}), 404
+
+    if item is not None:
+        ledger_add(family_id, request.user["uid"], "", "CATALOG_UPSERT", {"section": section, "item": item})
+    else:
+        ledger_add(family_id, request.user["uid"], "", "CATALOG_REMOVE", {"section": section, "id": remove_id})
+    return jsonify({"ok": True, "version": version})
 
+@traced("sync_timer_for_kid")
 def sync_timer_for_kid(family_id: str, uid: str):
-    s_snap = session_ref(family_id, uid).get()
-    w_snap = wallet_ref(family_id, uid).get()
+    s_snap, w_snap = get_docs([session_ref(family_id, uid), wallet_ref(family_id, uid)])
     if not s_snap.exists or not w_snap.exists:
         return
 
     s = s_snap.to_dict()
-    w = w_snap.to_dict()
 
-    if not s.get("active"):
+    # Cheap pre-check on the unlocked read; the transaction re-derives everything from its own read
+    if not s.get("active") or int(s.get("startTs") or 0) <= 0:
         return
-
-    start_ts = int(s.get("startTs") or 0)
-    if start_ts <= 0:
-        return
-
-    elapsed_seconds = max(0, now_ts() - start_ts)
-    elapsed_minutes = elapsed_seconds // 60
-    if elapsed_minutes <= 0:
+    if (now_ts() - int(s.get("startTs") or 0)) // 60 <= 0:
         return
 
-    cur_minutes = int(w.get("minutes") or 0)
-    new_minutes = max(0, cur_minutes - int(elapsed_minutes))
-    new_start = start_ts + int(elapsed_minutes) * 60
-
-    # Atomic-ish update: do in a transaction to avoid races
     def txn_op(txn):
         wref = wallet_ref(family_id, uid)
         sref = session_ref(family_id, uid)
-        w2 = txn.get(wref).to_dict()
-        s2 = txn.get(sref).to_dict()
-        if not s2.get("active"):
+        w_snap2, s_snap2 = txn_get(txn, wref), txn_get(txn, sref)
+        if not w_snap2.exists or not s_snap2.exists:
+            return
+        w2, s2 = w_snap2.to_dict(), s_snap2.to_dict()
+        start_ts = int(s2.get("startTs") or 0)
+        if not s2.get("active") or start_ts <= 0:
             return
 
+        # A sync that ran while this one waited has already moved startTs forward
+        elapsed_minutes = max(0, now_ts() - start_ts) // 60
+        if elapsed_minutes <= 0:
+            return
+        new_start = start_ts + int(elapsed_minutes) * 60
+
         cur_m = int(w2.get("minutes") or 0)
         nm = max(0, cur_m - int(elapsed_minutes))
         txn.update(wref, {"minutes": nm, "updatedTs": now_ts()})
+        record_point(txn, family_id, uid, w2.get("balanceGb"), nm)
 
         if nm == 0:
             txn.update(sref, {"active": False, "startTs": new_start, "endTs": now_ts(), "updatedTs": now_ts()})
         else:
             txn.update(sref, {"startTs": new_start, "updatedTs": now_ts()})
 
-    db.transaction()(txn_op)
+    run_txn(txn_op, lock_key=wallet_ref(family_id, uid).path, label="sync_timer")
 
 @app.get("/api/state")
 @auth_required(["admin","kid"])
 def api_state():
     family_id = request.user["family_id"]
 
-    # Sync timers for all kids (admin sees all; kid syncs self)
+    members = fam_ref(family_id).collection("members").where("role", "==", "kid").get()
+
+    # Sync timers for all kids (admin sees all; kid syncs self), in parallel
     if request.user["role"] == "admin":
-        members = fam_ref(family_id).collection("members").where("role", "==", "kid").stream()
-        for m in members:
-            uid = m.id
-            sync_timer_for_kid(family_id, uid)
+        run_concurrently(*[(lambda uid=m.id: sync_timer_for_kid(family_id, uid)) for m in members])
     else:
         sync_timer_for_kid(family_id, request.user["uid"])
 
-    # Build state
-    kids = []
-    members = fam_ref(family_id).collection("members").where("role", "==", "kid").stream()
+    # Build state: every wallet + session in one batched read, alongside the latest ledger entry
+    refs = []
     for m in members:
+        refs += [wallet_ref(family_id, m.id), session_ref(family_id, m.id)]
+    snaps, last = run_concurrently(
+        lambda: get_docs(refs),
+        lambda: ledger_col(family_id).order_by("ts", direction=firestore.Query.DESCENDING).limit(1).get()
+    )
+
+    kids = []
+    for i, m in enumerate(members):
         md = m.to_dict()
         uid = m.id
-        w = wallet_ref(family_id, uid).get().to_dict() or {}
-        s = session_ref(family_id, uid).get().to_dict() or {}
+        w = snaps[2*i].to_dict() or {}
+        s = snaps[2*i + 1].to_dict() or {}
         kids.append({
             "kid_user_id": uid,  # keep naming for frontend compatibility
             "name": md.get("name") or uid,
@@ -679,7 +1848,6 @@ def api_state():
         })
 
     # latest ledger entry
-    last = ledger_col(family_id).order_by("ts", direction=firestore.Query.DESCENDING).limit(1).get()
     latest = last[0].to_dict() if last else None
 
     return jsonify({"ok": True, "kids": kids, "latest_ledger": latest})
@@ -698,12 +1866,26 @@ def api_purchase_history():
     if request.user["role"] == "kid" and kid_uid != request.user["uid"]:
         return jsonify({"ok": False, "error": "Kids can only view their own history"}), 403
 
-    q = purchases_col(family_id).where("kidUid", "==", kid_uid).order_by("ts", direction=firestore.Query.DESCENDING).limit(50)
-    rows = [r.to_dict() for r in q.stream()]
+    try:
+        limit = min(max(int(request.args.get("limit") or HISTORY_PAGE_SIZE), 1), HISTORY_PAGE_MAX)
+    except ValueError:
+        return jsonify({"ok": False, "error": "limit must be an integer"}), 400
+
+    col = purchases_col(family_id)
+    after, err = resolve_cursor(col)
+    if err:
+        return jsonify({"ok": False, "error": err}), 400
+
+    q = col.where("kidUid", "==", kid_uid).order_by("ts", direction=firestore.Query.DESCENDING)
+    if after is not None:
+        q = q.start_after(after)
+    snaps = q.limit(limit).get()
 
     history = []
-    for r in rows:
+    for snap in snaps:
+        r = snap.to_dict()
         history.append({
+            "id": snap.id,
             "ts": int(r.get("ts") or 0),
             "type": r.get("type"),
             "label": r.get("label"),
@@ -711,31 +1893,589 @@ def api_purchase_history():
             "extra": r.get("extra")
         })
 
-    return jsonify({"ok": True, "history": history})
+    next_cursor = snaps[-1].id if len(snaps) == limit else None
+    return jsonify({"ok": True, "history": history, "next_cursor": next_cursor})
+
+# -------------------------
+# Spending rollups (per kid per day, maintained in the purchase transaction)
+# -------------------------
+def record_purchase(txn, family_id: str, uid: str, typ: str, label: str, cost: float, extra: dict):
+    """Write the purchase doc and bump the kid's daily rollup inside the caller's transaction."""
+    ts = now_ts()
+    txn.set(purchases_col(family_id).document(), {
+        "familyId": family_id,
+        "kidUid": uid,
+        "ts": ts,
+        "type": typ,
+        "label": label,
+        "costGb": cost,
+        "extra": extra
+    })
+
+    day = local_date(ts)
+    bump = {"count": firestore.Increment(1), "spentGb": firestore.Increment(cost)}
+    rollup = {
+        "kidUid": uid,
+        "day": day.isoformat(),
+        "count": firestore.Increment(1),
+        "spentGb": firestore.Increment(cost),
+        "byType": {typ: dict(bump)},
+        "updatedTs": ts
+    }
+    if typ == "food" and extra.get("category"):
+        rollup["byCategory"] = {extra["category"]: dict(bump)}
+    if typ == "screen":
+        rollup["screenMinutes"] = firestore.Increment(int(extra.get("minutes") or 0))
+    txn.set(rollup_ref(family_id, uid, day), rollup, merge=True)
+
+def period_key(day: datetime.date, granularity: str) -> str:
+    if granularity == "week":
+        return (day - datetime.timedelta(days=day.weekday())).isoformat()
+    if granularity == "month":
+        return day.strftime("%Y-%m")
+    return day.isoformat()
+
+def add_spend(acc: dict, count, spent):
+    acc["count"] = acc.get("count", 0) + int(count or 0)
+    acc["spent_gb"] = clamp_money(acc.get("spent_gb", 0.0) + float(spent or 0.0))
+
+@app.get("/api/spending")
+@auth_required(["admin","kid"])
+def api_spending():
+    """
+    Spending chart data from daily rollups (one batched read, no purchase scan).
+    Query:
+    ?kid_user_id=<uid>&granularity=day|week|month&days=30
+    """
+    family_id = request.user["family_id"]
+    kid_uid = (request.args.get("kid_user_id") or "").strip()
+    if not kid_uid:
+        return jsonify({"ok": False, "error": "kid_user_id required"}), 400
+    if request.user["role"] == "kid" and kid_uid != request.user["uid"]:
+        return jsonify({"ok": False, "error": "Kids can only view their own spending"}), 403
+
+    granularity = (request.args.get("granularity") or "day").strip()
+    if granularity not in ("day", "week", "month"):
+        return jsonify({"ok": False, "error": "granularity must be day|week|month"}), 400
+    try:
+        days = min(max(int(request.args.get("days") or 30), 1), ROLLUP_MAX_DAYS)
+    except ValueError:
+        return jsonify({"ok": False, "error": "days must be an integer"}), 400
+
+    today = local_date(now_ts())
+    first_day = today - datetime.timedelta(days=days - 1)
+    refs = [rollup_ref(family_id, kid_uid, first_day + datetime.timedelta(days=i)) for i in range(days)]
+
+    buckets, totals = {}, {"count": 0, "spent_gb": 0.0, "screen_minutes": 0}
+    for snap in db.get_all(refs):
+        if not snap.exists:
+            continue
+        r = snap.to_dict()
+        key = period_key(datetime.date.fromisoformat(r["day"]), granularity)
+        b = buckets.setdefault(key, {"period": key, "count": 0, "spent_gb": 0.0, "screen_minutes": 0,
+                                     "by_type": {}, "by_category": {}})
+        for acc in (b, totals):
+            add_spend(acc, r.get("count"), r.get("spentGb"))
+            acc["screen_minutes"] += int(r.get("screenMinutes") or 0)
+        for typ, v in (r.get("byType") or {}).items():
+            add_spend(b["by_type"].setdefault(typ, {}), v.get("count"), v.get("spentGb"))
+        for cat, v in (r.get("byCategory") or {}).items():
+            add_spend(b["by_category"].setdefault(cat, {}), v.get("count"), v.get("spentGb"))
+
+    return jsonify({
+        "ok": True,
+        "granularity": granularity,
+        "from": first_day.isoformat(),
+        "to": today.isoformat(),
+        "buckets": [buckets[k] for k in sorted(buckets)],
+        "totals": totals
+    })
+
+# -------------------------
+# Balance / minutes time series
+# -------------------------
+def downsample_lttb(points: list, threshold: int) -> list:
+    """Largest-Triangle-Three-Buckets over [(t, v)] sorted by t."""
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return points
+    out = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # average of the next bucket is the third triangle vertex
+        nxt_start = int((i + 1) * every) + 1
+        nxt_end = min(int((i + 2) * every) + 1, n)
+        nxt = points[nxt_start:nxt_end] or [points[-1]]
+        avg_t = sum(p[0] for p in nxt) / len(nxt)
+        avg_v = sum(p[1] for p in nxt) / len(nxt)
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        at, av = points[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((at - avg_t) * (points[j][1] - av) - (at - points[j][0]) * (avg_v - av))
+            if area > best_area:
+                best, best_area = j, area
+        out.append(points[best])
+        a = best
+    out.append(points[-1])
+    return out
+
+def downsample_minmax(points: list, threshold: int) -> list:
+    """Keep the min and max point of each bucket (in time order), threshold points total."""
+    n = len(points)
+    if threshold >= n or threshold < 2:
+        return points
+    buckets = max(1, threshold // 2)
+    size = n / buckets
+    out = []
+    for i in range(buckets):
+        chunk = points[int(i * size):int((i + 1) * size)]
+        if not chunk:
+            continue
+        lo = min(chunk, key=lambda p: p[1])
+        hi = max(chunk, key=lambda p: p[1])
+        out.extend(sorted({lo, hi}, key=lambda p: p[0]))
+    return out
+
+@app.get("/api/timeseries")
+@auth_required(["admin","kid"])
+def api_timeseries():
+    """
+    Balance and minutes over time for one kid, downsampled server-side.
+    Query:
+    ?kid_user_id=<uid>&days=30&points=300&method=lttb|minmax
+    Returns { balance:[[ts, gb], ...], minutes:[[ts, min], ...] }
+    """
+    family_id = request.user["family_id"]
+    kid_uid = (request.args.get("kid_user_id") or "").strip()
+    if not kid_uid:
+        return jsonify({"ok": False, "error": "kid_user_id required"}), 400
+    if request.user["role"] == "kid" and kid_uid != request.user["uid"]:
+        return jsonify({"ok": False, "error": "Kids can only view their own history"}), 403
+
+    method = (request.args.get("method") or "lttb").strip()
+    if method not in ("lttb", "minmax"):
+        return jsonify({"ok": False, "error": "method must be lttb|minmax"}), 400
+    try:
+        days = min(max(int(request.args.get("days") or 30), 1), TIMESERIES_MAX_DAYS)
+        max_points = max(int(request.args.get("points") or TIMESERIES_DEFAULT_POINTS), 3)
+    except ValueError:
+        return jsonify({"ok": False, "error": "days and points must be integers"}), 400
+
+    today = local_date(now_ts())
+    first_day = today - datetime.timedelta(days=days - 1)
+    refs = [timeseries_ref(family_id, kid_uid, first_day + datetime.timedelta(days=i)) for i in range(days)]
+
+    raw = []
+    for snap in db.get_all(refs):
+        if snap.exists:
+            raw.extend(snap.to_dict().get("p") or [])
+    raw.sort(key=lambda p: p.get("t") or 0)
+
+    downsample = downsample_lttb if method == "lttb" else downsample_minmax
+    balance = downsample([(int(p["t"]), float(p.get("b") or 0.0)) for p in raw], max_points)
+    minutes = downsample([(int(p["t"]), int(p.get("m") or 0)) for p in raw], max_points)
+
+    return jsonify({
+        "ok": True,
+        "method": method,
+        "from": first_day.isoformat(),
+        "to": today.isoformat(),
+        "raw_points": len(raw),
+        "balance": [list(p) for p in balance],
+        "minutes": [list(p) for p in minutes]
+    })
+
+# -------------------------
+# Export (streamed NDJSON, optional gzip)
+# -------------------------
+def iter_query_chunks(query, start_after=None, chunk_size=None):
+    """Yield snapshots of an ordered query, one limited read per chunk."""
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    cursor = start_after
+    while True:
+        q = query.limit(chunk_size)
+        if cursor is not None:
+            q = q.start_after(cursor)
+        snaps = q.get()
+        for snap in snaps:
+            yield snap
+        if len(snaps) < chunk_size:
+            return
+        cursor = snaps[-1]
+
+def export_line(row: dict, doc_id: str) -> str:
+    row = dict(row)
+    row["id"] = doc_id
+    return json.dumps(row, separators=(",", ":"), default=str) + "\n"
+
+def ndjson_body(lines, use_gzip=False):
+    """Encode NDJSON lines as bytes; gzip output is flushed once per chunk so clients can resume."""
+    if not use_gzip:
+        for line in lines:
+            yield line.encode("utf-8")
+        return
+    z = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    n = 0
+    for line in lines:
+        out = z.compress(line.encode("utf-8"))
+        if out:
+            yield out
+        n += 1
+        if n % EXPORT_CHUNK_SIZE == 0:
+            yield z.flush(zlib.Z_SYNC_FLUSH)
+    yield z.flush()
+
+def export_response(lines, basename: str):
+    use_gzip = request.args.get("gzip", "").lower() in ("1", "true", "yes")
+    if use_gzip:
+        mimetype, filename = "application/gzip", f"{basename}.ndjson.gz"
+    else:
+        mimetype, filename = "application/x-ndjson", f"{basename}.ndjson"
+    resp = Response(stream_with_context(ndjson_body(lines, use_gzip)), mimetype=mimetype)
+    resp.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+# -------------------------
+# Ledger archive (sealed cold-storage segments)
+# -------------------------
+def archive_configured() -> bool:
+    return bool(LEDGER_ARCHIVE_BUCKET or LEDGER_ARCHIVE_DIR)
+
+def archive_bucket():
+    from firebase_admin import storage
+    return storage.bucket(LEDGER_ARCHIVE_BUCKET, app=init_firebase()["app"])
+
+def segment_path(key: str) -> str:
+    return os.path.join(LEDGER_ARCHIVE_DIR, *key.split("/"))
+
+def segment_put(key: str, data: bytes):
+    if not archive_configured():
+        raise RuntimeError("Ledger archive storage is not configured")
+    if LEDGER_ARCHIVE_BUCKET:
+        archive_bucket().blob(key).upload_from_string(data, content_type="application/gzip")
+        return
+    path = segment_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def segment_get(key: str) -> bytes:
+    """Segment bytes; a missing segment (or store) raises RuntimeError like a failed hash check."""
+    from google.api_core.exceptions import NotFound
+    if not archive_configured():
+        raise RuntimeError(f"Ledger segment {key} is unreadable: archive storage is not configured")
+    try:
+        if LEDGER_ARCHIVE_BUCKET:
+            return archive_bucket().blob(key).download_as_bytes()
+        with open(segment_path(key), "rb") as f:
+            return f.read()
+    except (FileNotFoundError, NotFound):
+        raise RuntimeError(f"Ledger segment {key} is missing from the archive")
+
+def missing_segments(family_id: str) -> list:
+    """Keys of this family's sealed segments that the archive store can't serve."""
+    fam = fam_ref(family_id).get().to_dict() or {}
+    keys = [seg["key"] for seg in (fam.get("ledgerSegments") or [])]
+    if not keys:
+        return []
+    if not archive_configured():
+        return keys
+    if LEDGER_ARCHIVE_BUCKET:
+        bucket = archive_bucket()
+        return [k for k in keys if not bucket.blob(k).exists()]
+    return [k for k in keys if not os.path.exists(segment_path(k))]
+
+def read_segment(seg: dict):
+    """Yield (doc_id, event) from a sealed segment after checking its sha256."""
+    data = segment_get(seg["key"])
+    if hashlib.sha256(data).hexdigest() != seg["sha256"]:
+        raise RuntimeError(f"Ledger segment {seg['key']} failed hash check")
+    for line in gzip.decompress(data).decode("utf-8").splitlines():
+        if not line:
+            continue
+        row = json.loads(line)
+        yield row.pop("id"), row
+
+def seal_segment(family_id: str, rows: list) -> dict:
+    """Write rows [(doc_id, event)] as one compressed segment and return its manifest entry."""
+    body = "".join(export_line(row, doc_id) for doc_id, row in rows)
+    data = gzip.compress(body.encode("utf-8"))
+    digest = hashlib.sha256(data).hexdigest()
+    first, last = rows[0][1], rows[-1][1]
+    key = f"{family_id}/ledger-{first['ts']}-{last['ts']}-{digest[:12]}.ndjson.gz"
+    segment_put(key, data)
+    if hashlib.sha256(segment_get(key)).hexdigest() != digest:
+        raise RuntimeError(f"Ledger segment {key} did not read back intact")
+    return {
+        "key": key,
+        "sha256": digest,
+        "count": len(rows),
+        "bytes": len(data),
+        "fromTs": int(first["ts"]),
+        "toTs": int(last["ts"]),
+        "firstPrevHash": first.get("prevHash"),
+        "lastHash": last.get("hash"),
+        "sealedTs": now_ts()
+    }
+
+def archive_ledger(family_id: str, cutoff_ts: int) -> dict:
+    """
+    Move ledger events with ts < cutoff_ts into sealed segments.
+    Segments are cut on ts boundaries and the newest event always stays live (ledger_add chains from it),
+    so every event with ts <= ledgerArchivedThroughTs is in a segment. The manifest is written before
+    the docs are deleted; leftovers from an interrupted run are cleaned up on the next one.
+    """
+    if not archive_configured():
+        raise RuntimeError("Ledger archive storage is not configured")
+    fam = fam_ref(family_id).get().to_dict() or {}
+    through = int(fam.get("ledgerArchivedThroughTs") or 0)
+    col = ledger_col(family_id)
+
+    if through:
+        delete_in_batches(s.reference for s in iter_query_chunks(col.where("ts", "<=", through).order_by("ts")))
+
+    newest = col.order_by("ts", direction=firestore.Query.DESCENDING).limit(1).get()
+    if not newest:
+        return {"segments": [], "archived": 0}
+    cutoff_ts = min(int(cutoff_ts), int(newest[0].to_dict().get("ts") or 0))
+
+    sealed, archived = [], 0
+
+    def flush(rows):
+        seg = seal_segment(family_id, rows)
+        fam_ref(family_id).update({
+            "ledgerSegments": firestore.ArrayUnion([seg]),
+            "ledgerArchivedThroughTs": seg["toTs"]
+        })
+        delete_in_batches(col.document(doc_id) for doc_id, _ in rows)
+        sealed.append(seg)
+        return len(rows)
+
+    rows = []
+    query = col.where("ts", "<", cutoff_ts).order_by("ts")
+    for snap in iter_query_chunks(query):
+        row = snap.to_dict()
+        if len(rows) >= LEDGER_SEGMENT_MAX and row.get("ts") != rows[-1][1].get("ts"):
+            archived += flush(rows)
+            rows = []
+        rows.append((snap.id, row))
+    if rows:
+        archived += flush(rows)
+
+    return {"segments": sealed, "archived": archived}
+
+def iter_ledger(family_id: str, after_id: str = None):
+    """Yield (doc_id, event) for the whole ledger oldest-first: archived segments, then live docs."""
+    fam = fam_ref(family_id).get().to_dict() or {}
+    segments = sorted(fam.get("ledgerSegments") or [], key=lambda seg: seg["fromTs"])
+    through = int(fam.get("ledgerArchivedThroughTs") or 0)
+
+    skipping = bool(after_id)
+    for seg in segments:
+        for doc_id, row in read_segment(seg):
+            if skipping:
+                skipping = doc_id != after_id
+                continue
+            yield doc_id, row
+
+    col = ledger_col(family_id)
+    start = None
+    if skipping:
+        start = col.document(after_id).get()
+        if not start.exists:
+            return
+    query = col.order_by("ts")
+    if through:
+        query = col.where("ts", ">", through).order_by("ts")
+    for snap in iter_query_chunks(query, start):
+        yield snap.id, snap.to_dict()
+
+def ledger_cursor_known(family_id: str, cursor: str) -> bool:
+    """Whether cursor is a ledger event id, live or archived (archived ids mean scanning the segments)."""
+    if ledger_col(family_id).document(cursor).get().exists:
+        return True
+    fam = fam_ref(family_id).get().to_dict() or {}
+    for seg in fam.get("ledgerSegments") or []:
+        if any(doc_id == cursor for doc_id, _ in read_segment(seg)):
+            return True
+    return False
+
+def verify_ledger(family_id: str) -> dict:
+    """
+    Recompute every event hash and check each prevHash points at an earlier event (archived or live).
+    A link is good if it matches the last hash seen on the event's own chain (entries without a chain
+    are on the family chain), or any hash in a sliding window of recent events (same-second reordering,
+    concurrent unsharded appends). Memory stays flat: one head per chain plus the window.
+    """
+    checked = 0
+    bad_hashes, segment_errors = [], []
+    recent, pending, heads = {}, {}, {}
+    window = 4096
+
+    fam = fam_ref(family_id).get().to_dict() or {}
+    archived = sum(int(seg.get("count") or 0) for seg in (fam.get("ledgerSegments") or []))
+
+    try:
+        for doc_id, e in iter_ledger(family_id):
+            checked += 1
+            h = compute_ledger_hash(e.get("ts"), e.get("actorUid") or "", e.get("targetUid") or "",
+                                    e.get("type"), e.get("payloadJson"), e.get("prevHash"))
+            if h != e.get("hash"):
+                bad_hashes.append(doc_id)
+            chain = e.get("chain") or FAMILY_CHAIN
+            prev = e.get("prevHash")
+            if prev != GENESIS_HASH and prev not in recent and prev != heads.get(chain):
+                pending[prev] = doc_id
+            if e.get("type") == "ANCHOR":
+                # every anchored sub-chain head must precede the anchor
+                for head_chain, head in ((e.get("payload") or {}).get("heads") or {}).items():
+                    if head.get("hash") not in recent and head.get("hash") != heads.get(head_chain):
+                        pending[head.get("hash")] = doc_id
+            pending.pop(e.get("hash"), None)
+            heads[chain] = e.get("hash")
+            recent[e.get("hash")] = True
+            if len(recent) > window:
+                recent.pop(next(iter(recent)))
+    except RuntimeError as ex:
+        segment_errors.append(str(ex))
+
+    broken = list(pending.values())
+    return {
+        "valid": not (bad_hashes or broken or segment_errors),
+        "checked": checked,
+        "archived": archived,
+        "bad_hashes": bad_hashes[:50],
+        "broken_links": broken[:50],
+        "segment_errors": segment_errors
+    }
+
+@app.post("/api/admin/archive_ledger")
+@auth_required(["admin"])
+def api_admin_archive_ledger():
+    """
+    Seal ledger events older than the retention window into cold-storage segments.
+    Body (optional):
+    { "retention_days": 365 }
+    """
+    family_id = request.user["family_id"]
+    data = request.get_json(silent=True) or {}
+    retention_days = int(data.get("retention_days") or LEDGER_RETENTION_DAYS)
+    if retention_days < 1:
+        return jsonify({"ok": False, "error": "retention_days must be >= 1"}), 400
+    if not archive_configured():
+        return jsonify({"ok": False, "error": "Ledger archive storage not configured (set LEDGER_ARCHIVE_BUCKET or LEDGER_ARCHIVE_DIR)"}), 503
+
+    result = archive_ledger(family_id, now_ts() - retention_days * 86400)
+    if result["archived"]:
+        ledger_add(family_id, request.user["uid"], "", "ARCHIVE_LEDGER", {
+            "archived": result["archived"],
+            "segments": [seg["key"] for seg in result["segments"]]
+        })
+    return jsonify({"ok": True, "archived": result["archived"], "segments": result["segments"]})
+
+@app.post("/api/admin/anchor_ledger")
+@auth_required(["admin"])
+def api_admin_anchor_ledger():
+    """Write a family-level anchor over all ledger sub-chain heads now (sharded mode only)."""
+    if not LEDGER_SHARDED:
+        return jsonify({"ok": False, "error": "Ledger is not in sharded mode"}), 400
+    heads = anchor_ledger(request.user["family_id"], force=True)
+    return jsonify({"ok": True, "heads": heads or {}})
+
+@app.get("/api/admin/verify_ledger")
+@auth_required(["admin"])
+def api_admin_verify_ledger():
+    """Walk archived segments and live events, checking hashes and chain links."""
+    return jsonify({"ok": True, **verify_ledger(request.user["family_id"])})
+
+@app.get("/api/export/ledger")
+@auth_required(["admin"])
+def api_export_ledger():
+    """
+    Stream the family ledger oldest-first as NDJSON (one event per line, with its doc "id").
+    Archived segments are streamed first, so the export covers the full history.
+    Query (optional):
+    ?cursor=<id of last line received>  resume an interrupted export
+    ?gzip=1                             download as .ndjson.gz
+    """
+    family_id = request.user["family_id"]
+    cursor = (request.args.get("cursor") or "").strip() or None
+    # Check before streaming starts; once the 200 is sent a missing segment can only cut the stream short
+    missing = missing_segments(family_id)
+    if missing:
+        return jsonify({"ok": False, "error": "Archived ledger segments unavailable", "missing": missing[:50]}), 503
+    # An unknown cursor would otherwise stream nothing, which a resuming client reads as "done"
+    if cursor:
+        try:
+            known = ledger_cursor_known(family_id, cursor)
+        except RuntimeError as e:
+            return jsonify({"ok": False, "error": str(e)}), 503
+        if not known:
+            return jsonify({"ok": False, "error": "Unknown cursor"}), 400
+    lines = (export_line(row, doc_id) for doc_id, row in iter_ledger(family_id, after_id=cursor))
+    return export_response(lines, f"ledger-{family_id}")
+
+@app.get("/api/export/purchases")
+@auth_required(["admin","kid"])
+def api_export_purchases():
+    """
+    Stream purchases oldest-first as NDJSON.
+    Query (optional):
+    ?kid_user_id=<uid>   admins may filter to one kid; kids always get their own
+    ?cursor=<id of last line received>
+    ?gzip=1
+    """
+    family_id = request.user["family_id"]
+    kid_uid = (request.args.get("kid_user_id") or "").strip()
+    if request.user["role"] == "kid":
+        if kid_uid and kid_uid != request.user["uid"]:
+            return jsonify({"ok": False, "error": "Kids can only export their own history"}), 403
+        kid_uid = request.user["uid"]
+
+    col = purchases_col(family_id)
+    after, err = resolve_cursor(col)
+    if err:
+        return jsonify({"ok": False, "error": err}), 400
+
+    query = col
+    if kid_uid:
+        query = query.where("kidUid", "==", kid_uid)
+    query = query.order_by("ts", direction=firestore.Query.ASCENDING)
+    lines = (export_line(s.to_dict(), s.id) for s in iter_query_chunks(query, after))
+    return export_response(lines, f"purchases-{kid_uid or family_id}")
 
 # -------------------------
 # Kid purchases
 # -------------------------
 @app.post("/api/purchase_screen")
 @auth_required(["kid"])
+@idempotent
 def api_purchase_screen():
     family_id = request.user["family_id"]
     uid = request.user["uid"]
     data = request.get_json(force=True)
     package_id = data.get("package_id")
 
-    cfg = get_family_config(family_id)
+    cfg, _ = run_concurrently(lambda: get_family_config(family_id), lambda: sync_timer_for_kid(family_id, uid))
     pkg = next((p for p in (cfg.get("screen") or []) if p["id"] == package_id), None)
     if not pkg:
         return jsonify({"ok": False, "error": "Unknown package"}), 400
 
-    sync_timer_for_kid(family_id, uid)
-
     cost = clamp_money(pkg["cost_gb"])
     
+    event = ledger_event(uid, uid, "PURCHASE_SCREEN", {"package": pkg, "cost_gb": cost})
+
     def txn_op(txn):
+        idempotency_guard(txn)
         wref = wallet_ref(family_id, uid)
-        w = txn.get(wref).to_dict() or {}
+        w = txn_get(txn, wref).to_dict() or {}
         if w.get("locked"):
             raise ValueError("Screens locked for today")
 
@@ -747,67 +2487,55 @@ def api_purchase_screen():
         new_min = int(w.get("minutes") or 0) + int(pkg["minutes"])
 
         txn.update(wref, {"balanceGb": new_bal, "minutes": new_min, "updatedTs": now_ts()})
+        record_point(txn, family_id, uid, new_bal, new_min)
+        record_purchase(txn, family_id, uid, "screen", pkg["label"], cost, {"minutes": int(pkg["minutes"])})
+        idempotency_record(txn, {"ok": True}, ledger=event)
 
     try:
-        db.transaction()(txn_op)
-        # Add purchase record outside transaction (audit trail)
-        purchases_col(family_id).add({
-            "familyId": family_id,
-            "kidUid": uid,
-            "ts": now_ts(),
-            "type": "screen",
-            "label": pkg["label"],
-            "costGb": cost,
-            "extra": {"minutes": int(pkg["minutes"])}
-        })
+        run_txn(txn_op, lock_key=wallet_ref(family_id, uid).path)
     except ValueError as e:
         return jsonify({"ok": False, "error": str(e)}), 400
 
-    ledger_add(family_id, uid, uid, "PURCHASE_SCREEN", {"package": pkg, "cost_gb": cost})
+    ledger_add_after_commit(family_id, event)
     return jsonify({"ok": True})
 
 @app.post("/api/purchase_food")
 @auth_required(["kid"])
+@idempotent
 def api_purchase_food():
     family_id = request.user["family_id"]
     uid = request.user["uid"]
     data = request.get_json(force=True)
     item_id = data.get("item_id")
 
-    cfg = get_family_config(family_id)
+    cfg, _ = run_concurrently(lambda: get_family_config(family_id), lambda: sync_timer_for_kid(family_id, uid))
     item = next((i for i in (cfg.get("food") or []) if i["id"] == item_id), None)
     if not item:
         return jsonify({"ok": False, "error": "Unknown food item"}), 400
 
-    sync_timer_for_kid(family_id, uid)
-
     cost = clamp_money(item["cost_gb"])
     
+    event = ledger_event(uid, uid, "PURCHASE_FOOD", {"item": item, "cost_gb": cost})
+
     def txn_op(txn):
+        idempotency_guard(txn)
         wref = wallet_ref(family_id, uid)
-        w = txn.get(wref).to_dict() or {}
+        w = txn_get(txn, wref).to_dict() or {}
         bal = float(w.get("balanceGb") or 0.0)
         if bal < cost:
             raise ValueError("Not enough GB$")
 
         txn.update(wref, {"balanceGb": clamp_money(bal - cost), "updatedTs": now_ts()})
+        record_point(txn, family_id, uid, bal - cost, w.get("minutes"))
+        record_purchase(txn, family_id, uid, "food", item["label"], cost, {"category": item["category"]})
+        idempotency_record(txn, {"ok": True}, ledger=event)
 
     try:
-        db.transaction()(txn_op)
-        # Add purchase record outside transaction (audit trail)
-        purchases_col(family_id).add({
-            "familyId": family_id,
-            "kidUid": uid,
-            "ts": now_ts(),
-            "type": "food",
-            "label": item["label"],
-            "costGb": cost,
-            "extra": {"category": item["category"]}
-        })
+        run_txn(txn_op, lock_key=wallet_ref(family_id, uid).path)
     except ValueError as e:
         return jsonify({"ok": False, "error": str(e)}), 400
 
-    ledger_add(family_id, uid, uid, "PURCHASE_FOOD", {"item": item, "cost_gb": cost})
+    ledger_add_after_commit(family_id, event)
     return jsonify({"ok": True})
 
 # -------------------------
@@ -826,8 +2554,8 @@ def api_session_start():
     def txn_op(txn):
         wref = wallet_ref(family_id, uid)
         sref = session_ref(family_id, uid)
-        w = txn.get(wref).to_dict() or {}
-        s = txn.get(sref).to_dict() or {}
+        w = txn_get(txn, wref).to_dict() or {}
+        s = txn_get(txn, sref).to_dict() or {}
 
         if w.get("locked"):
             raise ValueError("Screens locked for today")
@@ -839,7 +2567,7 @@ def api_session_start():
         txn.set(sref, {"active": True, "mode": mode, "startTs": now_ts(), "endTs": None, "updatedTs": now_ts()}, merge=True)
 
     try:
-        db.transaction()(txn_op)
+        run_txn(txn_op, lock_key=wallet_ref(family_id, uid).path)
     except ValueError as e:
         return jsonify({"ok": False, "error": str(e)}), 400
 
@@ -879,25 +2607,23 @@ def api_daily_allotment():
     if not isinstance(amounts, dict):
         return jsonify({"ok": False, "error": "amounts must be a JSON object map"}), 400
 
-    applied = []
-    for kid_name, amt in amounts.items():
-        amt = clamp_money(amt)
-        if amt <= 0:
-            continue
+    wanted = [(kid_name, clamp_money(amt)) for kid_name, amt in amounts.items() if clamp_money(amt) > 0]
+    # find kid uids by member name (lookups are independent, so issue them together)
+    kid_uids = run_concurrently(*[(lambda n=kid_name: find_kid_uid(family_id, n)) for kid_name, _ in wanted])
 
-        # find kid uid by member name
-        matches = fam_ref(family_id).collection("members").where("role", "==", "kid").where("name", "==", kid_name).limit(1).get()
-        if not matches:
+    applied = []
+    for (kid_name, amt), kid_uid in zip(wanted, kid_uids):
+        if not kid_uid:
             continue
-        kid_uid = matches[0].id
 
         def txn_op(txn):
             wref = wallet_ref(family_id, kid_uid)
-            w = txn.get(wref).to_dict() or {}
+            w = txn_get(txn, wref).to_dict() or {}
             bal = float(w.get("balanceGb") or 0.0)
             txn.set(wref, {"balanceGb": clamp_money(bal + amt), "updatedTs": now_ts()}, merge=True)
+            record_point(txn, family_id, kid_uid, bal + amt, w.get("minutes"))
 
-        db.transaction()(txn_op)
+        run_txn(txn_op, lock_key=wallet_ref(family_id, kid_uid).path)
         ledger_add(family_id, request.user["uid"], kid_uid, "DAILY_ALLOTMENT", {"amount_gb": amt})
         applied.append({"kid": kid_name, "amount": amt})
 
@@ -905,36 +2631,40 @@ def api_daily_allotment():
 
 @app.post("/api/reward")
 @auth_required(["admin"])
+@idempotent
 def api_reward():
     family_id = request.user["family_id"]
     data = request.get_json(force=True)
     kid_name = (data.get("kid_name") or "").strip()
     action_id = data.get("action_id")
 
-    cfg = get_family_config(family_id)
+    cfg, kid_uid = run_concurrently(lambda: get_family_config(family_id), lambda: find_kid_uid(family_id, kid_name))
     action = next((a for a in (cfg.get("rewards") or []) if a["id"] == action_id), None)
     if not action:
         return jsonify({"ok": False, "error": "Unknown reward action"}), 400
-
-    matches = fam_ref(family_id).collection("members").where("role", "==", "kid").where("name", "==", kid_name).limit(1).get()
-    if not matches:
+    if not kid_uid:
         return jsonify({"ok": False, "error": "Unknown kid"}), 400
-    kid_uid = matches[0].id
 
     delta = clamp_money(action["delta_gb"])
 
+    event = ledger_event(request.user["uid"], kid_uid, "REWARD", {"action": action, "delta_gb": delta})
+
     def txn_op(txn):
+        idempotency_guard(txn)
         wref = wallet_ref(family_id, kid_uid)
-        w = txn.get(wref).to_dict() or {}
+        w = txn_get(txn, wref).to_dict() or {}
         bal = float(w.get("balanceGb") or 0.0)
         txn.set(wref, {"balanceGb": clamp_money(bal + delta), "updatedTs": now_ts()}, merge=True)
+        record_point(txn, family_id, kid_uid, bal + delta, w.get("minutes"))
+        idempotency_record(txn, {"ok": True}, ledger=event)
 
-    db.transaction()(txn_op)
-    ledger_add(family_id, request.user["uid"], kid_uid, "REWARD", {"action": action, "delta_gb": delta})
+    run_txn(txn_op, lock_key=wallet_ref(family_id, kid_uid).path)
+    ledger_add_after_commit(family_id, event)
     return jsonify({"ok": True})
 
 @app.post("/api/consequence_time")
 @auth_required(["admin"])
+@idempotent
 def api_consequence_time():
     family_id = request.user["family_id"]
     data = request.get_json(force=True)
@@ -942,22 +2672,22 @@ def api_consequence_time():
     consequence_id = data.get("consequence_id")
     note = (data.get("note") or "")[:120]
 
-    cfg = get_family_config(family_id)
+    cfg, kid_uid = run_concurrently(lambda: get_family_config(family_id), lambda: find_kid_uid(family_id, kid_name))
     c = next((x for x in (cfg.get("time_consequences") or []) if x["id"] == consequence_id), None)
     if not c:
         return jsonify({"ok": False, "error": "Unknown time consequence"}), 400
-
-    matches = fam_ref(family_id).collection("members").where("role", "==", "kid").where("name", "==", kid_name).limit(1).get()
-    if not matches:
+    if not kid_uid:
         return jsonify({"ok": False, "error": "Unknown kid"}), 400
-    kid_uid = matches[0].id
 
     sync_timer_for_kid(family_id, kid_uid)
 
+    event = ledger_event(request.user["uid"], kid_uid, "CONSEQUENCE_TIME", {"consequence": c, "note": note})
+
     def txn_op(txn):
+        idempotency_guard(txn)
         wref = wallet_ref(family_id, kid_uid)
         sref = session_ref(family_id, kid_uid)
-        w = txn.get(wref).to_dict() or {}
+        w = txn_get(txn, wref).to_dict() or {}
         minutes = int(w.get("minutes") or 0)
         locked = bool(w.get("locked") or False)
 
@@ -969,17 +2699,20 @@ def api_consequence_time():
             locked = bool(c["lock"])
 
         txn.set(wref, {"minutes": minutes, "locked": locked, "updatedTs": now_ts()}, merge=True)
+        record_point(txn, family_id, kid_uid, w.get("balanceGb"), minutes)
 
         if c["id"] in ("end_session", "lock_day"):
             txn.set(sref, {"active": False, "endTs": now_ts(), "updatedTs": now_ts()}, merge=True)
+        idempotency_record(txn, {"ok": True}, ledger=event)
 
-    db.transaction()(txn_op)
+    run_txn(txn_op, lock_key=wallet_ref(family_id, kid_uid).path)
 
-    ledger_add(family_id, request.user["uid"], kid_uid, "CONSEQUENCE_TIME", {"consequence": c, "note": note})
+    ledger_add_after_commit(family_id, event)
     return jsonify({"ok": True})
 
 @app.post("/api/consequence_money")
 @auth_required(["admin"])
+@idempotent
 def api_consequence_money():
     family_id = request.user["family_id"]
     data = request.get_json(force=True)
@@ -987,30 +2720,61 @@ def api_consequence_money():
     consequence_id = data.get("consequence_id")
     note = (data.get("note") or "")[:120]
 
-    cfg = get_family_config(family_id)
+    cfg, kid_uid = run_concurrently(lambda: get_family_config(family_id), lambda: find_kid_uid(family_id, kid_name))
     c = next((x for x in (cfg.get("money_consequences") or []) if x["id"] == consequence_id), None)
     if not c:
         return jsonify({"ok": False, "error": "Unknown money consequence"}), 400
-
-    matches = fam_ref(family_id).collection("members").where("role", "==", "kid").where("name", "==", kid_name).limit(1).get()
-    if not matches:
+    if not kid_uid:
         return jsonify({"ok": False, "error": "Unknown kid"}), 400
-    kid_uid = matches[0].id
 
     delta = clamp_money(c["delta_gb"])
 
+    event = ledger_event(request.user["uid"], kid_uid, "CONSEQUENCE_MONEY", {"consequence": c, "delta_gb": delta, "note": note})
+
     def txn_op(txn):
+        idempotency_guard(txn)
         wref = wallet_ref(family_id, kid_uid)
-        w = txn.get(wref).to_dict() or {}
+        w = txn_get(txn, wref).to_dict() or {}
         bal = float(w.get("balanceGb") or 0.0)
         new_bal = max(0.0, clamp_money(bal + delta))
         txn.set(wref, {"balanceGb": new_bal, "updatedTs": now_ts()}, merge=True)
+        record_point(txn, family_id, kid_uid, new_bal, w.get("minutes"))
+        idempotency_record(txn, {"ok": True}, ledger=event)
 
-    db.transaction()(txn_op)
+    run_txn(txn_op, lock_key=wallet_ref(family_id, kid_uid).path)
 
-    ledger_add(family_id, request.user["uid"], kid_uid, "CONSEQUENCE_MONEY", {"consequence": c, "delta_gb": delta, "note": note})
+    ledger_add_after_commit(family_id, event)
     return jsonify({"ok": True})
 
+@app.get("/api/admin/traces")
+@auth_required(["admin"])
+def api_admin_traces():
+    """
+    Recent traced requests for this family as Chrome-trace JSON (open in ui.perfetto.dev).
+    Query (optional):
+    ?min_ms=250   only requests at least this slow
+    ?save=1       also write them to this process's TRACE_DUMP_PATH file (traces.<pid>.json)
+    """
+    family_id = request.user["family_id"]
+    try:
+        min_us = int(float(request.args.get("min_ms") or 0) * 1000)
+    except (ValueError, OverflowError):
+        return jsonify({"ok": False, "error": "min_ms must be a number"}), 400
+    with _traces_lock:
+        traces = [t for t in _traces if t.get("family_id") == family_id and t["dur"] >= min_us]
+
+    if request.args.get("save") == "1":
+        if not TRACE_DUMP_PATH:
+            return jsonify({"ok": False, "error": "TRACE_DUMP_PATH not set"}), 400
+        dump_traces(TRACE_DUMP_PATH, family_id)
+    return jsonify(chrome_trace(traces))
+
+@app.get("/api/admin/txn_metrics")
+@auth_required(["admin"])
+def api_admin_txn_metrics():
+    """Per-endpoint transaction attempts, aborts, retries and lock wait for this server process."""
+    return jsonify({"ok": True, "pid": os.getpid(), "metrics": txn_metrics()})
+
 # -------------------------
 # Health
 # -------------------------
@@ -1019,4 +2783,6 @@ def api_health():
     return jsonify({"ok": True, "ts": now_ts()})
 
 if __name__ == "__main__":
+    register_trace_dump()
+    start_firebase_warmup()
     app.run(host="0.0.0.0", port=PORT, debug=False)
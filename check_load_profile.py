@@ -0,0 +1,104 @@
+"""
+Load profile for the production server: throughput vs worker count.
+
+Starts gunicorn (gunicorn.conf.py) with 1, 2, 4 ... up to the CPU count workers,
+drives it with concurrent keep-alive clients, and prints req/s and latency
+percentiles for each size.
+
+    python check_load_profile.py                      # /api/health, 64 clients, 10s per step
+    python check_load_profile.py --path /api/health --clients 128 --seconds 20
+
+Needs serviceAccountKey.json (or GOOGLE_APPLICATION_CREDENTIALS) because the
+server imports app.py.
+"""
+import argparse, http.client, os, socket, subprocess, sys, threading, time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_ready(port: int, path: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", path)
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"server on :{port} not ready after {timeout}s")
+
+def drive(port: int, path: str, clients: int, seconds: float):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.time() + seconds
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        mine = []
+        while time.time() < stop_at:
+            t0 = time.perf_counter()
+            try:
+                conn.request("GET", path)
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status != 200:
+                    raise OSError(resp.status)
+                mine.append(time.perf_counter() - t0)
+            except (OSError, http.client.HTTPException):
+                with lock:
+                    errors[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sorted(latencies), errors[0]
+
+def pct(sorted_vals, p):
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(len(sorted_vals) * p))] * 1000
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--path", default="/api/health")
+    ap.add_argument("--clients", type=int, default=64)
+    ap.add_argument("--seconds", type=float, default=10.0)
+    ap.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = ap.parse_args()
+
+    sizes, w = [], 1
+    while w < args.max_workers:
+        sizes.append(w)
+        w *= 2
+    sizes.append(args.max_workers)
+
+    print(f"{'workers':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for workers in sizes:
+        port = free_port()
+        env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers), LOG_LEVEL="warning")
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--access-logfile", os.devnull, "app:app"],
+            cwd=APP_DIR, env=env
+        )
+        try:
+            wait_ready(port, args.path)
+            lat, errors = drive(port, args.path, args.clients, args.seconds)
+            print(f"{workers:>7} {len(lat) / args.seconds:>9.0f} {pct(lat, 0.50):>8.1f} {pct(lat, 0.99):>8.1f} {errors:>7}")
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+if __name__ == "__main__":
+    main()
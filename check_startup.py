@@ -0,0 +1,93 @@
+"""
+Cold-start check: import-time report and startup latency.
+
+1. Runs `python -X importtime -c "import app"` and prints the slowest imports
+   (cumulative), failing if the total exceeds --import-budget-ms or if
+   firebase_admin got imported eagerly.
+2. Starts the server (gunicorn.conf.py, one worker), measures spawn -> first
+   200 from /api/health, and fails if that exceeds --startup-budget-ms.
+
+    python check_startup.py
+    python check_startup.py --top 25 --import-budget-ms 400 --startup-budget-ms 1500
+
+Exit status is non-zero when a budget is exceeded. Needs serviceAccountKey.json
+(or GOOGLE_APPLICATION_CREDENTIALS) to exist; Firebase itself is not contacted.
+"""
+import argparse, http.client, os, socket, subprocess, sys, time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def import_report(top: int):
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app, sys; print('firebase_admin' in sys.modules)"],
+        cwd=APP_DIR, capture_output=True, text=True, env=dict(os.environ, FIREBASE_WARMUP="0")
+    )
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        raise SystemExit("import app failed")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        # "import time:      self [us] |    cumulative | imported package"
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, self_us, cum_us, name = [p.strip() for p in line.replace("import time:", "|", 1).split("|")]
+        rows.append((int(cum_us), int(self_us), name))
+
+    total_us = sum(r[1] for r in rows)
+    print(f"import app: {total_us / 1000:.1f} ms across {len(rows)} modules")
+    print(f"{'cumul ms':>9} {'self ms':>8}  module")
+    for cum_us, self_us, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cum_us / 1000:>9.1f} {self_us / 1000:>8.1f}  {name}")
+    return total_us / 1000, proc.stdout.strip() == "True"
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def startup_latency(timeout: float = 30.0) -> float:
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY="1", LOG_LEVEL="warning")
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"], cwd=APP_DIR, env=env)
+    try:
+        while time.perf_counter() - t0 < timeout:
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+                conn.request("GET", "/api/health")
+                if conn.getresponse().status == 200:
+                    return (time.perf_counter() - t0) * 1000
+            except OSError:
+                pass
+            time.sleep(0.01)
+        raise SystemExit(f"/api/health not ready after {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--import-budget-ms", type=float, default=float(os.environ.get("IMPORT_BUDGET_MS", "500")))
+    ap.add_argument("--startup-budget-ms", type=float, default=float(os.environ.get("STARTUP_BUDGET_MS", "2000")))
+    args = ap.parse_args()
+
+    failures = []
+    import_ms, eager_firebase = import_report(args.top)
+    if eager_firebase:
+        failures.append("firebase_admin is imported at module import (should be lazy)")
+    if import_ms > args.import_budget_ms:
+        failures.append(f"import app took {import_ms:.0f} ms (budget {args.import_budget_ms:.0f} ms)")
+
+    ready_ms = startup_latency()
+    print(f"spawn -> first /api/health 200: {ready_ms:.0f} ms")
+    if ready_ms > args.startup_budget_ms:
+        failures.append(f"startup took {ready_ms:.0f} ms (budget {args.startup_budget_ms:.0f} ms)")
+
+    for f in failures:
+        print(f"FAIL: {f}")
+    raise SystemExit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
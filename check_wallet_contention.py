@@ -0,0 +1,85 @@
+"""
+Contention benchmark: many concurrent purchases against a single wallet.
+
+Runs the same workload twice through app.run_txn, first with per-wallet locks
+off (every writer races in Firestore) and then with them on. For each run it
+prints aborts, retries, and p50/p99/max latency, and checks the final balance.
+
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python check_wallet_contention.py
+    python check_wallet_contention.py --threads 16 --ops 25
+
+Writes under families/_bench_<random> and deletes the docs afterwards. Use the
+emulator unless you mean to spend real Firestore writes. Needs
+serviceAccountKey.json (or GOOGLE_APPLICATION_CREDENTIALS) like app.py.
+"""
+import argparse, os, sys, threading, time, uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app
+
+COST = 0.25
+
+def run(family_id: str, uid: str, threads: int, ops: int, locks: bool):
+    app.WALLET_LOCKS = locks
+    app._txn_stats.clear()
+    wref = app.wallet_ref(family_id, uid)
+    start_balance = threads * ops * COST
+    wref.set({"balanceGb": start_balance, "minutes": 0, "locked": False, "updatedTs": app.now_ts()})
+
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def buy(txn):
+        w = app.txn_get(txn, wref).to_dict() or {}
+        bal = float(w.get("balanceGb") or 0.0)
+        if bal < COST:
+            raise ValueError("Not enough GB$")
+        txn.update(wref, {"balanceGb": app.clamp_money(bal - COST), "minutes": int(w.get("minutes") or 0) + 10})
+
+    def worker():
+        for _ in range(ops):
+            t0 = time.perf_counter()
+            try:
+                app.run_txn(buy, lock_key=wref.path, label="bench")
+                with lock:
+                    latencies.append(time.perf_counter() - t0)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+
+    t0 = time.perf_counter()
+    ts = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    wall = time.perf_counter() - t0
+
+    final = wref.get().to_dict()
+    stats = app.txn_metrics().get("bench", {})
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+    expected = app.clamp_money(start_balance - len(latencies) * COST)
+    print(f"locks={'on ' if locks else 'off'}  ok={len(latencies):>4} err={len(errors):>3}  "
+          f"aborts={stats.get('aborts', 0):>4} retries={stats.get('retries', 0):>4}  "
+          f"p50={pct(0.50):7.1f}ms p99={pct(0.99):7.1f}ms max={pct(1.0):7.1f}ms  "
+          f"{len(latencies) / wall:6.1f} txn/s  balance {'OK' if app.clamp_money(final['balanceGb']) == expected else 'MISMATCH'}")
+    for e in errors[:3]:
+        print(f"    {e}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threads", type=int, default=12)
+    ap.add_argument("--ops", type=int, default=20, help="purchases per thread")
+    args = ap.parse_args()
+
+    family_id, uid = f"_bench_{uuid.uuid4().hex[:8]}", "kid"
+    app.fam_ref(family_id).set({"name": "contention bench", "createdTs": app.now_ts()})
+    try:
+        for locks in (False, True):
+            run(family_id, uid, args.threads, args.ops, locks)
+    finally:
+        app.delete_in_batches([app.wallet_ref(family_id, uid), app.fam_ref(family_id)])
+
+if __name__ == "__main__":
+    main()
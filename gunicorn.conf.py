@@ -0,0 +1,75 @@
+"""
+Gunicorn settings for container serving (Cloud Run).
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Workers and threads are sized from the CPUs the container is actually allowed
+to use (cgroup quota), and can be overridden with env vars:
+
+    WEB_CONCURRENCY   worker processes         (default: CPUs * WORKERS_PER_CPU)
+    WORKERS_PER_CPU   workers per CPU          (default: 1)
+    GUNICORN_THREADS  threads per worker       (default: 8; handlers mostly wait on Firestore)
+    MAX_REQUESTS      recycle a worker after N requests (default: 2000, 0 = never)
+"""
+import os
+
+def cpu_limit() -> int:
+    # cgroup v2 quota ("max 100000" means unlimited)
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, int(int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    # cgroup v1 quota
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return max(1, quota // period)
+    except (OSError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+CPUS = cpu_limit()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", CPUS * int(os.environ.get("WORKERS_PER_CPU", "1"))))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+
+# Import app.py (Flask and the app code) once in the master so workers fork with it already
+# loaded. firebase_admin, the credential parse and the Firestore client are not preloaded:
+# app.py builds them lazily, and each worker starts that in post_fork (warm-up below), so no
+# client or gRPC channel is shared across fork.
+preload_app = True
+
+# Recycle workers gradually (jitter keeps them from restarting together) and let
+# in-flight requests finish on shutdown/scale-in.
+max_requests = int(os.environ.get("MAX_REQUESTS", "2000"))
+max_requests_jitter = max_requests // 10
+graceful_timeout = 30
+
+# Cloud Run enforces its own request timeout; don't let gunicorn kill slow workers first.
+timeout = 0
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.environ.get("LOG_LEVEL", "info")
+
+def on_starting(server):
+    server.log.info(f"gunicorn: {workers} worker(s) x {threads} thread(s) on {CPUS} CPU(s)")
+
+def post_fork(server, worker):
+    # Firebase is initialized lazily; start opening this worker's channel and fetching
+    # token keys now so the first real request doesn't pay for it.
+    import app
+    app.start_firebase_warmup()
+    app.register_trace_dump()
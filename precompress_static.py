@@ -0,0 +1,63 @@
+"""
+Build step: write .gz (and .br, if the brotli package is installed) next to
+index.html and the text assets under public/, so the static handlers can send
+them without compressing per request.
+
+    python precompress_static.py
+    python precompress_static.py --force
+
+Already-compressed formats (png/jpg/...) are skipped, as are files whose
+compressed form is not smaller. Variants are only rewritten when the source is
+newer, unless --force is given.
+"""
+import argparse, gzip, os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+TEXT_EXTENSIONS = {".html", ".css", ".js", ".mjs", ".json", ".svg", ".txt", ".xml", ".map"}
+
+def targets():
+    yield os.path.join(APP_DIR, "index.html")
+    for root, _, files in os.walk(os.path.join(APP_DIR, "public")):
+        for f in files:
+            if os.path.splitext(f)[1].lower() in TEXT_EXTENSIONS:
+                yield os.path.join(root, f)
+
+def write_variant(src: str, ext: str, compress, force: bool):
+    dst = src + ext
+    if not force and os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(src):
+        return None
+    with open(src, "rb") as f:
+        data = f.read()
+    out = compress(data)
+    if len(out) >= len(data):
+        if os.path.exists(dst):
+            os.remove(dst)
+        return None
+    with open(dst, "wb") as f:
+        f.write(out)
+    return len(data), len(out)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--force", action="store_true")
+    args = ap.parse_args()
+
+    encoders = [(".gz", lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+    if brotli:
+        encoders.append((".br", lambda d: brotli.compress(d, quality=11)))
+    else:
+        print("brotli not installed; writing .gz only")
+
+    for src in targets():
+        for ext, compress in encoders:
+            sizes = write_variant(src, ext, compress, args.force)
+            if sizes:
+                print(f"{os.path.relpath(src, APP_DIR)}{ext}: {sizes[0]} -> {sizes[1]} bytes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+read_member_counters for families created before memberCount/adminCount existed.
+
+Runs against a real Firestore client and Transaction (no server needed): only the query
+stream is replaced, so the library's own argument checks in Transaction.get still apply.
+"""
+import json, os, sys, tempfile
+
+import pytest
+
+# app.py refuses to import without a service account file; Firebase itself is never initialized here
+_key = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+json.dump({}, _key)
+_key.close()
+os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", _key.name)
+os.environ["FIREBASE_WARMUP"] = "0"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from google.auth.credentials import AnonymousCredentials  # noqa: E402
+from google.cloud import firestore as gfirestore  # noqa: E402
+from google.cloud.firestore_v1.query import Query  # noqa: E402
+
+
+class FakeSnap:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return self._data
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = gfirestore.Client(project="test", credentials=AnonymousCredentials())
+    monkeypatch.setattr(app, "db", client)
+    return client
+
+
+def test_counts_members_when_family_has_no_counters(client, monkeypatch):
+    members = [
+        FakeSnap("kid1", {"role": "kid"}),
+        FakeSnap("mom", {"role": "admin"}),
+        FakeSnap("dad", {"role": "admin"}),
+    ]
+    seen = []
+
+    def fake_stream(self, transaction=None, **kwargs):
+        seen.append((self, transaction))
+        return iter(members)
+
+    monkeypatch.setattr(Query, "stream", fake_stream)
+    txn = client.transaction()
+
+    counters = app.read_member_counters(txn, "fam1", {"name": "Old family"})
+
+    assert counters == {"memberCount": 3, "adminCount": 2, "firstAdminUid": "mom"}
+    query, used_txn = seen[0]
+    assert used_txn is txn
+    assert query._parent.id == "members"
+
+
+def test_uses_stored_counters_without_reading_members(client, monkeypatch):
+    monkeypatch.setattr(Query, "stream", lambda *a, **kw: pytest.fail("members should not be read"))
+
+    counters = app.read_member_counters(client.transaction(), "fam1", {
+        "memberCount": 4, "adminCount": 1, "firstAdminUid": "mom"
+    })
+
+    assert counters == {"memberCount": 4, "adminCount": 1, "firstAdminUid": "mom"}